@@ -2,6 +2,7 @@ import json
 import os
 import argparse
 import glob
+from state_store import get_state_store
 
 def fill_rule(initial_candidates):
     with open("spider2_data.json", "r", encoding="utf-8") as f:
@@ -75,8 +76,7 @@ def fill_rule(initial_candidates):
     return final_schemas
 
 def add_pre_rule(log_path):
-    cache_path = os.path.join(log_path, "cache")
-    status_path = os.path.join(log_path, "status")
+    state_store = get_state_store(log_path)
     
     with open(f"{log_path}/initial_candidates.json", "r", encoding="utf-8") as f:
         initial_candidates = json.load(f)
@@ -107,11 +107,7 @@ def add_pre_rule(log_path):
         else:
             raise ValueError(f"Unknown instance_id: {instance_id}")
         
-        with open(f"{status_path}/{instance_id}.json", "r", encoding="utf-8") as f:
-            status = json.load(f)
-        
-        with open(f"{cache_path}/{instance_id}.json", "r", encoding="utf-8") as f:
-            cache = json.load(f)
+        cache, status = state_store.load(instance_id)
         
         if status["is_complete"]:
             continue
@@ -120,15 +116,15 @@ def add_pre_rule(log_path):
         cache_updated = False
         status_updated = False
         
+        with open(f"{embedding_path}/{db_name}/metadata.json", "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        
         for table in table_candidates:
             if table not in seen_tables:
                 seen_tables.append(table)
             else:
                 continue
                 
-            with open(f"{embedding_path}/{db_name}/metadata.json", "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-                
             for index, all_columns in enumerate(metadata):
                 if all_columns["table"] != table:
                     continue
@@ -145,7 +141,7 @@ def add_pre_rule(log_path):
                     add_id_candidates[instance_id]["column_values"].append(column_value)
                     add_id_candidates[instance_id]["descriptions"].append(description)
                     
-                    cache["used_indices"].append(index)
+                    cache["used_indices"].add(index)
                     cache_updated = True
                     status["used_count"] += 1 
                     status_updated = True
@@ -160,13 +156,8 @@ def add_pre_rule(log_path):
         if status_updated:
             status["remaining_count"] = status["total_available"] - status["used_count"]
         
-        if status_updated: 
-            with open(f"{status_path}/{instance_id}.json", "w", encoding="utf-8") as f:
-                json.dump(status, f, ensure_ascii=False, indent=4)
-        
-        if cache_updated: 
-            with open(f"{cache_path}/{instance_id}.json", "w", encoding="utf-8") as f:
-                json.dump(cache, f, ensure_ascii=False, indent=4)
+        if status_updated or cache_updated: 
+            state_store.save(instance_id, cache, status)
                 
     with open(f"{log_path}/unfilled_pre_rule.json", "w", encoding="utf-8") as f:
         json.dump(add_id_candidates, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,507 @@
+import os
+import time
+import argparse
+import numpy as np
+import faiss
+from retrieve_topk_schema import search_excluding, prepare_queries
+from embedding_docs import build_index
+from index_cache import apply_search_params
+
+
+def _timeit(func, repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+def _legacy_search(index, metadata_mapping, query_embedding, excluded_indices, top_k):
+    distances, indices = index.search(query_embedding.reshape(1, -1), len(metadata_mapping))
+    filtered_results = []
+    for i in range(len(indices[0])):
+        idx = int(indices[0][i])
+        if 0 <= idx < len(metadata_mapping) and idx not in excluded_indices:
+            filtered_results.append({
+                "index": idx,
+                "distance": float(distances[0][i]),
+                "metadata": metadata_mapping[idx]
+            })
+            if len(filtered_results) >= top_k:
+                break
+    return filtered_results
+
+
+def bench_retrieval(sizes, dim: int, top_k: int, num_excluded: int, repeats: int):
+    rng = np.random.default_rng(0)
+    print(f"{'columns':>8} {'excluded':>8} {'full rank (ms)':>15} {'top-k (ms)':>11} {'speedup':>8} {'identical':>9}")
+    for size in sizes:
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        index = faiss.IndexFlatL2(dim)
+        index.add(vectors)
+        metadata_mapping = [{"column": f"c{i}"} for i in range(size)]
+        query = rng.standard_normal(dim, dtype=np.float32)
+
+        # Exclude the nearest columns, as repeated retrievals for one instance do.
+        _, nearest = index.search(query.reshape(1, -1), min(size, num_excluded))
+        excluded_indices = set(int(i) for i in nearest[0])
+
+        legacy_ms, legacy = _timeit(lambda: _legacy_search(index, metadata_mapping, query, excluded_indices, top_k), repeats)
+        new_ms, new = _timeit(lambda: search_excluding(index, metadata_mapping, query, excluded_indices, top_k), repeats)
+        identical = [r["index"] for r in legacy] == [r["index"] for r in new]
+        print(f"{size:>8} {len(excluded_indices):>8} {legacy_ms:>15.2f} {new_ms:>11.2f} {legacy_ms / new_ms:>7.1f}x {str(identical):>9}")
+
+
+def _load_vectors(embed_path: str, db_name: str, size: int, dim: int, rng):
+    if embed_path:
+        index = faiss.read_index(f"{embed_path}/{db_name}/index.faiss")
+        return index.reconstruct_n(0, index.ntotal)
+    # Clustered unit vectors resemble BGE column embeddings better than uniform noise.
+    centers = rng.standard_normal((max(1, size // 50), dim), dtype=np.float32)
+    assignments = rng.integers(0, len(centers), size)
+    vectors = centers[assignments] + 0.3 * rng.standard_normal((size, dim), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def bench_ann(embed_path: str, db_name: str, size: int, dim: int, num_queries: int, top_k: int):
+    rng = np.random.default_rng(0)
+    vectors = np.ascontiguousarray(_load_vectors(embed_path, db_name, size, dim, rng), dtype=np.float32)
+    picks = rng.integers(0, len(vectors), num_queries)
+    queries = vectors[picks] + 0.1 * rng.standard_normal((num_queries, vectors.shape[1]), dtype=np.float32)
+
+    flat_index, _ = build_index(vectors, index_type="flat")
+    flat_ms, (_, truth) = _timeit(lambda: flat_index.search(queries, top_k), 1)
+    print(f"{len(vectors)} columns, dim {vectors.shape[1]}, {num_queries} queries, recall@{top_k} against flat")
+    print(f"{'index':>9} {'setting':>14} {'build (s)':>10} {'recall':>7} {'ms/query':>9}")
+    print(f"{'flat':>9} {'-':>14} {'-':>10} {1.0:>7.3f} {flat_ms / num_queries:>9.3f}")
+
+    sweeps = {"hnsw": ("efSearch", [16, 64, 128, 256]), "ivf_flat": ("nprobe", [1, 8, 32, 128]),
+              "ivf_pq": ("nprobe", [1, 8, 32, 128])}
+    for index_type, (name, values) in sweeps.items():
+        start = time.perf_counter()
+        index, params = build_index(vectors, index_type=index_type)
+        build_s = time.perf_counter() - start
+        for value in values:
+            apply_search_params(index, {name: value})
+            ms, (_, found) = _timeit(lambda: index.search(queries, top_k), 1)
+            recall = np.mean([len(set(f) & set(t)) / top_k for f, t in zip(found, truth)])
+            default = "*" if params.get(name) == value else ""
+            print(f"{index_type:>9} {f'{name}={value}{default}':>14} {build_s:>10.1f} {recall:>7.3f} {ms / num_queries:>9.3f}")
+    print("* = value written to index_params.json by embedding_docs.py")
+
+
+def bench_storage(embed_path: str, db_name: str, size: int, dim: int, num_queries: int, top_k: int):
+    rng = np.random.default_rng(0)
+    vectors = np.ascontiguousarray(_load_vectors(embed_path, db_name, size, dim, rng), dtype=np.float32)
+    picks = rng.integers(0, len(vectors), num_queries)
+    queries = vectors[picks] + 0.1 * rng.standard_normal((num_queries, vectors.shape[1]), dtype=np.float32)
+
+    print(f"{len(vectors)} columns, dim {vectors.shape[1]}, {num_queries} queries, agreement with float32 flat L2")
+    print(f"{'storage':>8} {'resident MB':>12} {'top-1 agree':>12} {f'recall@{top_k}':>10} {'ms/query':>9}")
+    baseline = None
+    for storage in ("float32", "float16", "int8"):
+        index, params = build_index(vectors, index_type="flat", storage=storage)
+        resident_mb = faiss.serialize_index(index).nbytes / 1024**2
+        ms, (_, found) = _timeit(lambda: index.search(prepare_queries(queries, params), top_k), 1)
+        if baseline is None:
+            baseline = found
+        top1 = np.mean(found[:, 0] == baseline[:, 0])
+        recall = np.mean([len(set(f) & set(b)) / top_k for f, b in zip(found, baseline)])
+        print(f"{storage:>8} {resident_mb:>12.1f} {top1:>12.3f} {recall:>10.3f} {ms / num_queries:>9.3f}")
+
+
+def _rss_worker(embed_path: str, db_name: str, use_mmap: bool, num_queries: int, ready, results):
+    from index_cache import IndexCache
+    cache = IndexCache(use_mmap=use_mmap)
+    index, metadata_mapping = cache.get(embed_path, db_name)
+    rng = np.random.default_rng()
+    for _ in range(num_queries):
+        query = rng.standard_normal(index.d, dtype=np.float32)
+        for result in search_excluding(index, metadata_mapping, query, set(), 5):
+            result["metadata"]["column"]
+    status = {}
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon", "RssFile"):
+                status[name] = int(value.split()[0]) / 1024
+    results.put(status)
+    # Stay alive until every worker has measured, so shared pages stay shared.
+    ready.wait()
+
+
+def bench_rss(size: int, dim: int, workers: list, num_queries: int):
+    import tempfile
+    import json
+    import multiprocessing as mp
+    from metadata_store import write_metadata_store
+
+    rng = np.random.default_rng(0)
+    embed_path = tempfile.mkdtemp()
+    db_dir = f"{embed_path}/bench_db"
+    os.makedirs(db_dir)
+    index, _ = build_index(_load_vectors(None, None, size, dim, rng), index_type="flat")
+    faiss.write_index(index, f"{db_dir}/index.faiss")
+    metadata_mapping = [{"table": f"table_{i // 20}", "column": f"column_{i}", "column_type": "STRING",
+                         "column_value": ["a" * 40] * 3, "description": "d" * 200} for i in range(size)]
+    with open(f"{db_dir}/metadata.json", "w", encoding="utf-8") as f:
+        json.dump(metadata_mapping, f)
+    write_metadata_store(f"{db_dir}/metadata.bin", metadata_mapping)
+    del index, metadata_mapping
+
+    ctx = mp.get_context("spawn")
+    print(f"{size} columns, dim {dim}; MB per worker (RssAnon is private, RssFile is shared page cache)")
+    print(f"{'mode':>7} {'workers':>8} {'VmRSS':>8} {'RssAnon':>8} {'RssFile':>8}")
+    for use_mmap in (False, True):
+        for num_workers in workers:
+            ready = ctx.Event()
+            results = ctx.Queue()
+            processes = [ctx.Process(target=_rss_worker, args=(embed_path, "bench_db", use_mmap, num_queries, ready, results))
+                         for _ in range(num_workers)]
+            for p in processes:
+                p.start()
+            stats = [results.get() for _ in processes]
+            ready.set()
+            for p in processes:
+                p.join()
+            mean = {name: np.mean([s[name] for s in stats]) for name in ("VmRSS", "RssAnon", "RssFile")}
+            mode = "mmap" if use_mmap else "private"
+            print(f"{mode:>7} {num_workers:>8} {mean['VmRSS']:>8.1f} {mean['RssAnon']:>8.1f} {mean['RssFile']:>8.1f}")
+
+
+def bench_encode(model_path: str, device: str, threads: list, texts_per_thread: int, window_ms: float, max_batch_size: int):
+    from concurrent.futures import ThreadPoolExecutor
+    from model_manager import model_manager
+    from encode_batcher import EncodeBatcher
+
+    model_manager.load_model(model_path, device=device, use_server=False)
+    print(f"encode throughput on {model_manager.get_device()}; unbatched is max_batch_size=1")
+    print(f"{'mode':>9} {'threads':>8} {'texts/s':>9} {'mean batch':>11}")
+    run = 0
+    for mode, batch_size in (("unbatched", 1), ("batched", max_batch_size)):
+        for num_threads in threads:
+            run += 1
+            # Unique texts per run so the embedding cache never answers.
+            model_manager.batcher = EncodeBatcher(model_manager._encode_texts, window_ms=window_ms, max_batch_size=batch_size)
+            texts = [[f"run {run} thread {t} question {i} about table column values" for i in range(texts_per_thread)]
+                     for t in range(num_threads)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                list(executor.map(lambda chunk: [model_manager.encode(text) for text in chunk], texts))
+            elapsed = time.perf_counter() - start
+            stats = model_manager.get_batch_stats()
+            print(f"{mode:>9} {num_threads:>8} {num_threads * texts_per_thread / elapsed:>9.1f} {stats['mean_batch_size']:>11.1f}")
+
+
+def bench_cpu_backend(model_path: str, backends: list, num_threads: int, num_queries: int, num_docs: int,
+                      batch_size: int, top_k: int):
+    from model_manager import load_sentence_transformer
+
+    model_path = model_path or "BAAI/bge-large-en-v1.5"
+    queries = [f"Which customers placed more than {i} orders in region {i % 7}?" for i in range(num_queries)]
+    docs = [f"Table: orders_{i % 40}\nColumn: field_{i}\nType: STRING\nDescription: value {i} of order attribute {i % 13}"
+            for i in range(num_docs)]
+
+    embeddings = {}
+    print(f"{num_threads or 'default'} threads, {num_queries} queries, {num_docs} documents")
+    print(f"{'backend':>8} {'latency (ms)':>13} {'texts/s':>9} {'cosine':>7} {f'top-{top_k} agree':>13}")
+    for backend in ["torch"] + [backend for backend in backends if backend != "torch"]:
+        model = load_sentence_transformer(model_path, "cpu", backend, num_threads)
+        model.encode(queries[:2], convert_to_numpy=True)
+        latency, _ = _timeit(lambda: [model.encode(query, convert_to_numpy=True) for query in queries[:20]], 1)
+        start = time.perf_counter()
+        query_vectors = model.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+        doc_vectors = model.encode(docs, batch_size=batch_size, convert_to_numpy=True)
+        throughput = (len(queries) + len(docs)) / (time.perf_counter() - start)
+        embeddings[backend] = (query_vectors, doc_vectors)
+
+        reference_queries, reference_docs = embeddings["torch"]
+        cosine = np.mean(np.sum(query_vectors * reference_queries, axis=1) /
+                         (np.linalg.norm(query_vectors, axis=1) * np.linalg.norm(reference_queries, axis=1)))
+        reference_top = np.argsort(-(reference_queries @ reference_docs.T), axis=1)[:, :top_k]
+        backend_top = np.argsort(-(query_vectors @ doc_vectors.T), axis=1)[:, :top_k]
+        agreement = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(reference_top, backend_top)])
+        print(f"{backend:>8} {latency / 20:>13.2f} {throughput:>9.1f} {cosine:>7.4f} {agreement:>13.3f}")
+
+
+def bench_embed(input_file: str, db_name: str, model_path: str, device: str, batch_size: int, num_shards: int):
+    from sentence_transformers import SentenceTransformer
+    from embedding_docs import collect_columns, encode_documents, EMBED_MODEL
+
+    if input_file:
+        from document_store import get_document_store
+        store = get_document_store(input_file)
+        db_name = db_name or store.db_names()[0]
+        descriptions, _ = collect_columns(db_name, store.read(db_name))
+    else:
+        # Date-sharded tables repeating one column set, plus a few distinct tables.
+        rng = np.random.default_rng(0)
+        shared = [f"Column field_{i}: " + "value description " * int(rng.integers(1, 40)) for i in range(30)]
+        distinct = [f"Column other_{i}: " + "text " * int(rng.integers(1, 120)) for i in range(300)]
+        descriptions = shared * num_shards + distinct
+
+    model = SentenceTransformer(model_path or EMBED_MODEL, device=device)
+    encode = lambda texts: model.encode(texts, convert_to_numpy=True)
+    encode(descriptions[:batch_size])
+
+    start = time.perf_counter()
+    baseline = np.concatenate([encode(descriptions[i:i + batch_size]) for i in range(0, len(descriptions), batch_size)])
+    baseline_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embeddings, num_unique = encode_documents(encode, descriptions, batch_size)
+    seconds = time.perf_counter() - start
+
+    cosine = np.mean(np.sum(embeddings * baseline, axis=1) /
+                     (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(baseline, axis=1)))
+    print(f"{len(descriptions)} documents, {num_unique} unique, batch size {batch_size}")
+    print(f"{'mode':>18} {'seconds':>8} {'docs/s':>9}")
+    print(f"{'file order':>18} {baseline_seconds:>8.2f} {len(descriptions) / baseline_seconds:>9.1f}")
+    print(f"{'dedup + bucketed':>18} {seconds:>8.2f} {len(descriptions) / seconds:>9.1f}")
+    print(f"speedup {baseline_seconds / seconds:.1f}x, mean cosine to file-order vectors {cosine:.5f}")
+
+
+def _legacy_group_partitions(tables):
+    from utils import remove_digits
+
+    processed_tables = {}
+    for table_name, column_names, column_types, column_descriptions, sample_rows in tables:
+        current_column_set = set(column_names)
+        current_column_types_dict = dict(zip(column_names, column_types))
+        current_descriptions_dict = dict(zip(column_names, column_descriptions))
+        is_partition = False
+        for table, info in processed_tables.items():
+            if remove_digits(table_name) == remove_digits(table):
+                existing_column_set = set(info["columns"])
+                intersection = current_column_set & existing_column_set
+                union = current_column_set | existing_column_set
+                if len(union) > 0 and len(intersection) / len(union) >= 1:
+                    info["similar_tables"].append(table_name)
+                    merged_columns = info["columns"].copy()
+                    for col in column_names:
+                        if col not in merged_columns:
+                            merged_columns.append(col)
+                    merged_column_types = info["column_types"].copy()
+                    existing_types_dict = dict(zip(info["columns"], info["column_types"]))
+                    for col in merged_columns:
+                        if col not in existing_types_dict:
+                            merged_column_types.append(current_column_types_dict.get(col, ""))
+                    merged_descriptions = info["description"].copy()
+                    existing_desc_dict = dict(zip(info["columns"], info["description"]))
+                    for col in merged_columns:
+                        if col not in existing_desc_dict:
+                            merged_descriptions.append(current_descriptions_dict.get(col, ""))
+                    info["columns"] = merged_columns
+                    info["column_types"] = merged_column_types
+                    info["description"] = merged_descriptions
+                    is_partition = True
+                    break
+        if not is_partition:
+            processed_tables[table_name] = {"columns": column_names, "column_types": column_types,
+                                            "similar_tables": [], "description": column_descriptions,
+                                            "sample_rows": sample_rows}
+    return processed_tables
+
+
+def _synthetic_shards(num_shards: int, num_families: int, rng):
+    columns = [f"field_{i}" for i in range(20)]
+    tables = []
+    for i in range(num_shards):
+        # Date-sharded families; every 10th shard of a family drifts to a different column set.
+        family, shard = i % num_families, i // num_families
+        shard_columns = columns + [f"extra_{family}"] + (["added"] if shard % 10 == 9 else [])
+        tables.append((f"project.dataset.events_{chr(97 + family % 26)}{family // 26}_x_{20200101 + shard}",
+                       shard_columns, ["STRING"] * len(shard_columns),
+                       [f"description {c}" for c in shard_columns], [{c: i for c in shard_columns}]))
+    for i in range(num_shards // 100):
+        tables.append((f"project.dataset.lookup_table_{chr(97 + i % 26)}{i}", columns[:5], ["INT64"] * 5,
+                       ["d"] * 5, []))
+    # Malformed tables whose types/descriptions are shorter than their columns.
+    tables.append(("project.dataset.broken_1", ["a", "b", "c"], ["INT64"], [], []))
+    tables.append(("project.dataset.broken_2", ["c", "b", "a"], ["STRING", "STRING", "STRING"], ["x", "y", "z"], []))
+    tables.append(("project.dataset.empty_1", [], [], [], []))
+    tables.append(("project.dataset.empty_2", [], [], [], []))
+    order = rng.permutation(len(tables))
+    return [tables[i] for i in order]
+
+
+def bench_partitions(num_shards: int, num_families: int):
+    import copy
+    from generate_docs import group_partitions
+
+    tables = _synthetic_shards(num_shards, num_families, np.random.default_rng(0))
+    legacy_input, new_input = copy.deepcopy(tables), copy.deepcopy(tables)
+
+    legacy_ms, legacy = _timeit(lambda: _legacy_group_partitions(legacy_input), 1)
+    new_ms, grouped = _timeit(lambda: group_partitions(new_input), 1)
+    print(f"{len(tables)} tables -> {len(grouped)} groups")
+    print(f"legacy scan {legacy_ms:.1f} ms, hash buckets {new_ms:.1f} ms, speedup {legacy_ms / new_ms:.0f}x, "
+          f"identical {list(legacy.items()) == list(grouped.items())}")
+
+
+def _legacy_preprocess_json_content(content):
+    import re
+    from generate_schema import fix_common_json_issues
+
+    content = content.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
+    content = re.sub(r'\s+', ' ', content)
+    content = re.sub(r'array\([^)]*\)', '[]', content)
+    content = content.replace('\\"', '"').replace("'", '"').replace("None", "null").replace("True", "true").replace("False", "false")
+    return fix_common_json_issues(content)
+
+
+def _nested_columns(input_file: str, num_columns: int, rng):
+    """(values, column_type) pairs of STRUCT/ARRAY columns, from a documents file or synthetic."""
+    import json
+    from generate_schema import get_column_type
+
+    columns = []
+    if input_file:
+        from document_store import get_document_store
+        store = get_document_store(input_file)
+        for db_name in store.db_names():
+            for table_info in store.read(db_name).values():
+                for column_type, values in zip(table_info["column_types"], table_info["sample_values"]):
+                    if any(get_column_type(column_type)) and isinstance(values, list) and len(values) >= 3:
+                        columns.append((values, column_type))
+        return columns[:num_columns]
+
+    for i in range(num_columns):
+        rows = []
+        for j in range(3):
+            record = {"id": f"{i}-{j}", "score": float(rng.random()), "tags": [f"tag{k}" for k in range(i % 5)],
+                      "geo": {"lat": float(rng.random()), "lon": float(rng.random()), "name": "x" * (i % 150)}}
+            if i % 3 == 0:
+                # BigQuery exports STRUCTs as Python reprs.
+                rows.append(repr({**record, "active": True, "parent": None}))
+            else:
+                rows.append(json.dumps(record))
+        columns.append((rows, "STRUCT<id STRING, score FLOAT64>" if i % 2 else "ARRAY<STRUCT<id STRING>>"))
+    return columns
+
+
+def bench_values(input_file: str, num_columns: int, num_instances: int):
+    import generate_schema
+    from generate_schema import process_values, get_column_type
+
+    columns = _nested_columns(input_file, num_columns, np.random.default_rng(0))
+    if not columns:
+        print("no nested columns with sample values found")
+        return
+
+    def run():
+        # Every instance retrieving a database renders the same columns again.
+        return [process_values(values, *get_column_type(column_type), max_length=100)
+                for _ in range(num_instances) for values, column_type in columns]
+
+    def uncached(value, kind, max_length):
+        return generate_schema._render_nested_value(value, kind, max_length)
+
+    fast_path, render_nested_value = generate_schema.preprocess_json_content, generate_schema.render_nested_value
+    try:
+        generate_schema.preprocess_json_content = _legacy_preprocess_json_content
+        generate_schema.render_nested_value = uncached
+        legacy_ms, legacy = _timeit(run, 1)
+        generate_schema.preprocess_json_content = fast_path
+        direct_ms, direct = _timeit(run, 1)
+    finally:
+        generate_schema.preprocess_json_content = fast_path
+        generate_schema.render_nested_value = render_nested_value
+    generate_schema._render_nested_value_cached.cache_clear()
+    cached_ms, cached = _timeit(run, 1)
+
+    print(f"{len(columns)} nested columns x {num_instances} instances")
+    print(f"{'mode':>22} {'ms':>9} {'speedup':>8}")
+    for name, ms in [("legacy", legacy_ms), ("direct parse", direct_ms), ("direct parse + memo", cached_ms)]:
+        print(f"{name:>22} {ms:>9.1f} {legacy_ms / ms:>7.1f}x")
+    print(f"identical {legacy == direct == cached}, cache {generate_schema._render_nested_value_cached.cache_info()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    retrieval_parser = subparsers.add_parser("retrieval", help="exclusion-aware top-k search vs full ranking")
+    retrieval_parser.add_argument('--sizes', type=int, nargs="+", default=[1000, 5000, 10000, 30000])
+    retrieval_parser.add_argument('--dim', type=int, default=1024)
+    retrieval_parser.add_argument('--top_k', type=int, default=3)
+    retrieval_parser.add_argument('--num_excluded', type=int, default=200)
+    retrieval_parser.add_argument('--repeats', type=int, default=20)
+
+    ann_parser = subparsers.add_parser("ann", help="recall@k and latency of approximate indexes vs flat")
+    ann_parser.add_argument('--embed_path', type=str, default=None, help="use vectors from an existing flat index")
+    ann_parser.add_argument('--db_name', type=str, default=None)
+    ann_parser.add_argument('--size', type=int, default=50000)
+    ann_parser.add_argument('--dim', type=int, default=256)
+    ann_parser.add_argument('--num_queries', type=int, default=200)
+    ann_parser.add_argument('--top_k', type=int, default=10)
+
+    storage_parser = subparsers.add_parser("storage", help="resident size and ranking agreement of compact storage")
+    storage_parser.add_argument('--embed_path', type=str, default=None, help="use vectors from an existing flat index")
+    storage_parser.add_argument('--db_name', type=str, default=None)
+    storage_parser.add_argument('--size', type=int, default=30000)
+    storage_parser.add_argument('--dim', type=int, default=1024)
+    storage_parser.add_argument('--num_queries', type=int, default=200)
+    storage_parser.add_argument('--top_k', type=int, default=10)
+
+    rss_parser = subparsers.add_parser("rss", help="per-worker RSS with private vs memory-mapped indexes")
+    rss_parser.add_argument('--size', type=int, default=30000)
+    rss_parser.add_argument('--dim', type=int, default=1024)
+    rss_parser.add_argument('--workers', type=int, nargs="+", default=[1, 2, 4, 8])
+    rss_parser.add_argument('--num_queries', type=int, default=50)
+
+    encode_parser = subparsers.add_parser("encode", help="multi-threaded encode throughput with and without micro-batching")
+    encode_parser.add_argument('--model_path', type=str, default=None)
+    encode_parser.add_argument('--device', type=str, default="cuda:0")
+    encode_parser.add_argument('--threads', type=int, nargs="+", default=[1, 4, 16])
+    encode_parser.add_argument('--texts_per_thread', type=int, default=50)
+    encode_parser.add_argument('--window_ms', type=float, default=2.0)
+    encode_parser.add_argument('--max_batch_size', type=int, default=64)
+
+    cpu_parser = subparsers.add_parser("cpu_backend", help="CPU encode latency, throughput and ranking agreement vs fp32")
+    cpu_parser.add_argument('--model_path', type=str, default=None)
+    cpu_parser.add_argument('--backends', type=str, nargs="+", default=["int8", "onnx"])
+    cpu_parser.add_argument('--num_threads', type=int, default=None)
+    cpu_parser.add_argument('--num_queries', type=int, default=100)
+    cpu_parser.add_argument('--num_docs', type=int, default=1000)
+    cpu_parser.add_argument('--batch_size', type=int, default=32)
+    cpu_parser.add_argument('--top_k', type=int, default=10)
+
+    embed_parser = subparsers.add_parser("embed", help="document encoding throughput: file order vs dedup + length buckets")
+    embed_parser.add_argument('--input_file', type=str, default=None, help="documents json; synthetic shards if omitted")
+    embed_parser.add_argument('--db_name', type=str, default=None)
+    embed_parser.add_argument('--model_path', type=str, default=None)
+    embed_parser.add_argument('--device', type=str, default="cuda:0")
+    embed_parser.add_argument('--batch_size', type=int, default=1024)
+    embed_parser.add_argument('--num_shards', type=int, default=200)
+
+    partitions_parser = subparsers.add_parser("partitions", help="partition grouping in generate_documents, legacy vs hash buckets")
+    partitions_parser.add_argument('--num_shards', type=int, default=10000)
+    partitions_parser.add_argument('--num_families', type=int, default=500)
+
+    values_parser = subparsers.add_parser("values", help="nested sample-value rendering in generate_schema")
+    values_parser.add_argument('--input_file', type=str, default=None, help="documents json; synthetic samples if omitted")
+    values_parser.add_argument('--num_columns', type=int, default=500)
+    values_parser.add_argument('--num_instances', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "retrieval":
+        bench_retrieval(args.sizes, args.dim, args.top_k, args.num_excluded, args.repeats)
+    elif args.benchmark == "ann":
+        bench_ann(args.embed_path, args.db_name, args.size, args.dim, args.num_queries, args.top_k)
+    elif args.benchmark == "storage":
+        bench_storage(args.embed_path, args.db_name, args.size, args.dim, args.num_queries, args.top_k)
+    elif args.benchmark == "rss":
+        bench_rss(args.size, args.dim, args.workers, args.num_queries)
+    elif args.benchmark == "encode":
+        bench_encode(args.model_path, args.device, args.threads, args.texts_per_thread, args.window_ms, args.max_batch_size)
+    elif args.benchmark == "cpu_backend":
+        bench_cpu_backend(args.model_path, args.backends, args.num_threads, args.num_queries, args.num_docs,
+                          args.batch_size, args.top_k)
+    elif args.benchmark == "embed":
+        bench_embed(args.input_file, args.db_name, args.model_path, args.device, args.batch_size, args.num_shards)
+    elif args.benchmark == "partitions":
+        bench_partitions(args.num_shards, args.num_families)
+    elif args.benchmark == "values":
+        bench_values(args.input_file, args.num_columns, args.num_instances)
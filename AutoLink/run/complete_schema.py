@@ -1,7 +1,15 @@
 import os
 import json
+import time
+import queue
+import asyncio
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 from retrieve_topk_schema import get_next_k_results
+from index_cache import index_cache
+from state_store import get_state_store
+from document_store import get_document_store
+from prompt_budget import fit_user_input, recorded_budget
 from utils import *
 import transformers
 from tqdm import tqdm
@@ -14,14 +22,15 @@ import sqlite3
 from google.cloud import bigquery
 import snowflake.connector
 import pandas as pd
-import shutil
 import argparse
 
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), base_url=os.environ.get("OPENAI_BASE_URL"))
 bigquery_credential_paths = glob.glob(os.path.join("bigquery_credentials", "**", "*.json"), recursive=True)
-sqlite_lock = threading.Lock()
+sqlite_locks = {}
+sqlite_locks_guard = threading.Lock()
 credential_usage_count = {}
 credential_lock = threading.Lock()
+bigquery_client_lock = threading.Lock()
 
 def get_least_used_credential():
     global credential_usage_count, bigquery_credential_paths
@@ -41,41 +50,27 @@ def get_least_used_credential():
     return selected_credential
 
 def backup_instance_state(instance_id: str, log_path: str):
-    cache_dir = os.path.join(log_path, "cache")
-    status_dir = os.path.join(log_path, "status")
-    backup_dir = os.path.join(log_path, "backup")
-    
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    cache_file = os.path.join(cache_dir, f"{instance_id}.json")
-    status_file = os.path.join(status_dir, f"{instance_id}.json")
-    
-    backup_cache_file = os.path.join(backup_dir, f"{instance_id}_cache.json")
-    backup_status_file = os.path.join(backup_dir, f"{instance_id}_status.json")
-    
-    if not os.path.exists(backup_cache_file) and not os.path.exists(backup_status_file):
-        shutil.copy2(cache_file, backup_cache_file)
-        shutil.copy2(status_file, backup_status_file)
+    get_state_store(log_path).backup(instance_id)
 
 def restore_instance_state(instance_id: str, log_path: str):
-    cache_dir = os.path.join(log_path, "cache")
-    status_dir = os.path.join(log_path, "status")
-    backup_dir = os.path.join(log_path, "backup")
-    
-    backup_cache_file = os.path.join(backup_dir, f"{instance_id}_cache.json")
-    backup_status_file = os.path.join(backup_dir, f"{instance_id}_status.json")
-    
-    cache_file = os.path.join(cache_dir, f"{instance_id}.json")
-    status_file = os.path.join(status_dir, f"{instance_id}.json")
-    
-    if os.path.exists(backup_cache_file):
-        shutil.copy2(backup_cache_file, cache_file)
-    if os.path.exists(backup_status_file):
-        shutil.copy2(backup_status_file, status_file)           
+    get_state_store(log_path).restore(instance_id)
+
+def bigquery_client(credential_path: str):
+    # The client reads GOOGLE_APPLICATION_CREDENTIALS when it is created; the
+    # lock keeps concurrent tool threads from picking up each other's credential.
+    with bigquery_client_lock:
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credential_path
+        return bigquery.Client()
+
+def sqlite_lock(db_name: str):
+    # Every call opens its own connection, so only queries on the same
+    # database file are serialized; different databases run in parallel.
+    with sqlite_locks_guard:
+        return sqlite_locks.setdefault(db_name, threading.Lock())
 
 def thread_safe_sql_execution(instance_id, sql, db_name):
     if instance_id.startswith("local"):
-        with sqlite_lock:
+        with sqlite_lock(db_name):
             return sql_execution(instance_id, sql, db_name)
     else:
         return sql_execution(instance_id, sql, db_name)
@@ -84,9 +79,8 @@ def sql_execution(instance_id, sql, db_name):
     if instance_id.startswith("bq") or instance_id.startswith("ga"):
         used_credential = []
         bigquery_credential_path = get_least_used_credential()
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = bigquery_credential_path
         used_credential.append(bigquery_credential_path)
-        client = bigquery.Client()
+        client = bigquery_client(bigquery_credential_path)
         try:
             query_job = client.query(sql)
             results = query_job.result().to_dataframe()
@@ -99,7 +93,6 @@ def sql_execution(instance_id, sql, db_name):
                 print("403 Quota exceeded")
                 remaining_credentials = [cred for cred in bigquery_credential_paths if cred not in used_credential]
                 for credential_path in remaining_credentials:
-                    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credential_path
                     used_credential.append(credential_path)
                     
                     with credential_lock:
@@ -107,7 +100,7 @@ def sql_execution(instance_id, sql, db_name):
                             credential_usage_count[credential_path] = 0
                         credential_usage_count[credential_path] += 1
                         
-                    client = bigquery.Client()
+                    client = bigquery_client(credential_path)
                     try:
                         query_job = client.query(sql)
                         results = query_job.result().to_dataframe()
@@ -183,232 +176,533 @@ def remove_column_values(schema_text):
             
     return '\n'.join(processed_lines)
 
-def process_instance_batch(batch_instances, log_path):
-    cache_path = os.path.join(log_path, "cache")
-    status_path = os.path.join(log_path, "status")
-    schema_path = os.path.join(log_path, "schema_prompts")
-    model_output_path = os.path.join(log_path, "model_output")
-    tool_calls_path = os.path.join(log_path, "tool_calls")
-    input_path = os.path.join(log_path, "input")
-    candidates_path = os.path.join(log_path, "candidates")
-    error_path = os.path.join(log_path, "error")
+LLM_MODEL = "deepseek-chat"
+MAX_TURNS = 10
+RETRIEVAL_TOP_K = 3
+DEFAULT_MAX_INSTANCES = 256
+DEFAULT_LLM_CONCURRENCY = 64
+DEFAULT_RETRIEVAL_THREADS = 4
+DEFAULT_SQL_THREADS = 32
+TURN_COUNTS_FILE = "turn_counts.json"
+COLUMNS_PER_TURN = 1000
 
-    for instance_id, info in tqdm(batch_instances.items(), leave=False, desc=f"Thread {os.getpid()}"):
-        
+TOOL_REMINDER = "\nFor `@sql_execution`, if the results return column names or table names including the missing tables or columns you think, in this turn, you must use the @schema_retrieval tool to retrieve the missing tables or columns.\nBecause we will use initial schema and the results of `@sql_execution` tool as the final schema. Please do not think that the columns obtained by @sql_execution will be recalled. Only the columns obtained by `@schema_retrieval` can be considered to be recalled correctly.\nPlease also pay attention to the column name like `*id`, `*name`, `*text`, `*code` and so on. These columns are often crucial for final SQL construction, especially for joins, filtering, and output.\nYou also need to pay attention that Some important columns may exist in more than one table, but the initial schema may include only one instance. This can cause critical tables to be omitted if you're not careful. Always check whether a column name is shared across tables, and whether the other tables containing it also provide relevant context for the question."
+
+
+class InstanceConversation:
+    """One instance's schema-linking conversation.
+
+    Holds the messages, logs and candidates of the instance. The process and
+    async engines drive it the same way and only differ in how the model is
+    called and where ``retrieve``/``execute`` run:
+
+        while conversation.next_turn():
+            calls = conversation.parse_output(<model output>)
+            for each (line, func): retrieval_query/retrieval_result or sql_query/sql_result
+            conversation.end_turn(<model output>)
+        conversation.save()
+    """
+
+    def __init__(self, instance_id: str, info: dict, log_path: str, spider2_data: dict, budget: int = None):
         restore_instance_state(instance_id, log_path)
-        
-        each_candidates = {}
 
-        embed_path = determine_embedding_path(instance_id)
+        self.instance_id = instance_id
+        self.log_path = log_path
+        self.embed_path = determine_embedding_path(instance_id)
 
         if instance_id.startswith("bq") or instance_id.startswith("ga"):
-            documents_path = "documents/bigquery.json"
             sql_type = BIGQUERY
             sql_optimization = BIGQUERY_DIALECT_OPTIMIZATION
         elif instance_id.startswith("sf"):
-            documents_path = "documents/snowflake.json"
             sql_type = SNOWFLAKE
             sql_optimization = SNOWFLAKE_DIALECT_OPTIMIZATION
         elif instance_id.startswith("local"):
-            documents_path = "documents/localdb.json"
             sql_type = SQLITE
             sql_optimization = SQLITE_DIALECT_OPTIMIZATION
 
-        with open(documents_path, "r", encoding="utf-8") as f:
-            documents = json.load(f)
-
-        with open("spider2_data.json", "r", encoding="utf-8") as f:
-            spider2_data = json.load(f)
-        
         if instance_id not in spider2_data:
             raise ValueError(f"Instance ID {instance_id} not found in spider2_data.json")
-        
+
         konwledge_name = spider2_data[instance_id].get("external_knowledge", None)
-        knowledge_data = ""
-        
-        if konwledge_name:
-            knowledge_path = os.path.join("resource/documents", konwledge_name)
-            try:
-                with open(knowledge_path, "r", encoding="utf-8") as f:
-                    knowledge_data = f.read()
-            except Exception as e:
-                print(instance_id, e)
+        knowledge_data = read_external_knowledge(instance_id, konwledge_name)
 
-        question = info["question"]
-        db_name = info["db_name"]
+        self.question = info["question"]
+        self.db_name = info["db_name"]
 
-        db_documents = documents[db_name]
+        db_documents = get_document_store(determine_documents_path(instance_id)).load(self.db_name)
 
-        with open(f"{schema_path}/{instance_id}.txt", "r", encoding="utf-8") as f:
+        with open(f"{log_path}/schema_prompts/{instance_id}.txt", "r", encoding="utf-8") as f:
             retrieved_schemas = f.read()
-        
+
         all_tables = list(db_documents.keys())
-        all_calls = {}
-        all_model_output = ""
-        all_inputs = ""
+        self.all_calls = {}
+        self.all_model_output = ""
+        self.all_inputs = ""
 
         system_prompt = SCHEMA_LINKING.format(
             SQL_TYPE=sql_type,
             SQL_OPTIMIZATION=sql_optimization,
         )
-        
-        messages = [
+
+        # The schema was already reduced to the budget by generate_schema; this
+        # applies the matching ALL_TABLES and external knowledge trimming under
+        # the same budget (see recorded_budget).
+        _, user_input, token_usage = fit_user_input(retrieved_schemas, self.question, knowledge_data, all_tables,
+                                                    budget=budget)
+        if token_usage["over_budget"]:
+            print(f"Instance {instance_id}: user input {token_usage['total']} tokens exceeds the budget "
+                  f"of {token_usage['budget']}: {token_usage['sections']}")
+
+        self.messages = [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": USER_INPUT.format(
-                RETRIEVED_SCHEMA=json.dumps(retrieved_schemas, ensure_ascii=False),
-                USER_QUESTION=question,
-                EXTERNAL_KNOWLEDGE=knowledge_data,
-                ALL_TABLES=json.dumps(all_tables, ensure_ascii=False),
-            )}
+            {"role": "user", "content": user_input}
         ]
 
-        is_finished = False
-        is_error = False
+        self.turn = 0
+        self.is_finished = False
+        self.is_error = False
+        self.tool_calls = []
+        self.func_messages = ""
+
+        self.column_candidates = []
+        self.table_candidates = []
+        self.column_type_candidates = []
+        self.column_value_candidates = []
+        self.description_candidates = []
+
+    def next_turn(self) -> bool:
+        """Log the input of the next turn; False once the conversation is over."""
+        if self.turn >= MAX_TURNS:
+            return False
+        self.all_inputs += f"Turn {self.turn}\n" + str(self.messages) + "\n" + "=" * 50 + "\n\n"
+        return not (self.is_finished or self.is_error)
+
+    def parse_output(self, model_output: str) -> list:
+        """Record the model output and return its ``(line, tool_call)`` pairs."""
+        self.all_model_output += (f"Turn {self.turn}\n" +
+                                  # "=============MODEL REASONING=============" +
+                                  # model_reason + "\n" +
+                                  # "=============MODEL OUTPUT=============" +
+                                  model_output + "\n" + "=" * 50 + "\n\n")
 
-        column_candidates = []
-        table_candidates = []
-        column_type_candidates = []
-        column_value_candidates = []
-        description_candidates = []
+        try:
+            full_lines, tool_calls = parse_model_output(model_output)
+        except Exception as e:
+            full_lines = []
+            tool_calls = []
+            self.is_error = True
+
+            with open(os.path.join(self.log_path, "error", self.instance_id) + '.txt', "w", encoding="utf-8") as f:
+                f.write(model_output)
+
+        self.tool_calls = tool_calls
+        self.func_messages = ""
+        return list(zip(full_lines, tool_calls))
+
+    def retrieval_query(self, line: str, func: dict):
+        """Text to retrieve for a @schema_retrieval call, or None if the call is empty."""
+        table = func["table"]
+        column = func["column"]
+        description = func["description"]
+
+        if table == "" and column == "" and description == "":
+            return None
+
+        self.func_messages += f"Tool: {line} \n The tool returns the following results:"
+
+        return "column name: " + column + "\n" + \
+               "table name: " + table + "\n" + \
+               "description: " + description
+
+    def retrieve(self, retrieve_content: str):
+        return get_next_k_results(
+            instance_id=self.instance_id,
+            question=retrieve_content,
+            db_name=self.db_name,
+            embed_path=self.embed_path,
+            top_k=RETRIEVAL_TOP_K,
+            log_dir=self.log_path,
+            device="cuda:0")
+
+    def retrieval_result(self, func: dict, semantic_results: list, metadata_mapping: dict, text: str):
+        new_results = ""
+        for result in semantic_results:
+            metadata = result["metadata"]
+            description = metadata["description"]
+            self.func_messages += f"{description}\n"
+            new_results += f"{description}\n"
+            self.column_candidates.append(metadata["column"])
+            self.table_candidates.append(metadata["table"])
+            self.column_type_candidates.append(metadata["column_type"])
+            self.column_value_candidates.append(metadata["column_value"])
+            self.description_candidates.append(description)
+
+        if text:
+            self.func_messages += f"{text}\n"
+        func["result"] = new_results
+        self.func_messages += "\n"
+
+    def sql_query(self, line: str, func: dict):
+        """Query of a @sql_execution/@sql_draft call, or None if the call is empty."""
+        query = func["query"]
+
+        if query == "":
+            return None
+        self.func_messages += f"Tool: {line} \n The tool returns the following results:\n"
+        return query
+
+    def execute(self, query: str):
+        return thread_safe_sql_execution(self.instance_id, query, self.db_name)
+
+    def sql_result(self, func: dict, exec_status: str, results):
+        self.func_messages += f"{results}\n\n"
+        func["result"] = str(results)
+
+    def end_turn(self, model_output: str):
+        self.all_calls[f"turn_{self.turn}"] = self.tool_calls
+        self.func_messages += TOOL_REMINDER
+
+        self.messages.append({"role": "assistant", "content": model_output})
+        self.messages.append({"role": "user", "content": self.func_messages})
+        self.turn += 1
+
+    def save(self) -> bool:
+        each_candidates = {self.instance_id: {
+            "question": self.question,
+            "db_name": self.db_name,
+            "column_candidates": self.column_candidates,
+            "column_types": self.column_type_candidates,
+            "column_values": self.column_value_candidates,
+            "table_candidates": self.table_candidates,
+            "descriptions": self.description_candidates,
+        }}
+
+        if self.is_error:
+            print(f"Error occurred for instance {self.instance_id}. Skipping...")
+            return False
+
+        with open(os.path.join(self.log_path, "model_output", self.instance_id) + '.txt', "w", encoding="utf-8") as f:
+            f.write(self.all_model_output)
+
+        with open(os.path.join(self.log_path, "tool_calls", self.instance_id) + '.json', "w", encoding="utf-8") as f:
+            json.dump(self.all_calls, f, ensure_ascii=False, indent=2)
+
+        with open(os.path.join(self.log_path, "input", self.instance_id) + '.txt', "w", encoding="utf-8") as f:
+            f.write(self.all_inputs)
+
+        with open(os.path.join(self.log_path, "candidates", self.instance_id) + '.json', "w", encoding="utf-8") as f:
+            json.dump(each_candidates, f, ensure_ascii=False, indent=2)
+        return True
 
-        for i in range(10):
-            
-            all_inputs += f"Turn {i}\n" + str(messages) + "\n" + "=" * 50 + "\n\n"
 
-            if is_finished or is_error:
+def process_instance(instance_id: str, info: dict, log_path: str, spider2_data: dict, budget: int = None):
+    """Run one conversation to the end; returns (saved, number of model turns)."""
+    conversation = InstanceConversation(instance_id, info, log_path, spider2_data, budget)
+
+    while conversation.next_turn():
+        response = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=conversation.messages,
+        )
+        model_output = response.choices[0].message.content
+
+        for line, func in conversation.parse_output(model_output):
+            if func["tool"] == "stop":
+                conversation.is_finished = True
                 break
+            elif func["tool"] == "schema_retrieval":
+                retrieve_content = conversation.retrieval_query(line, func)
+                if retrieve_content is not None:
+                    conversation.retrieval_result(func, *conversation.retrieve(retrieve_content))
+            elif func["tool"] == "sql_execution" or func["tool"] == "sql_draft":
+                query = conversation.sql_query(line, func)
+                if query is not None:
+                    conversation.sql_result(func, *conversation.execute(query))
+
+        conversation.end_turn(model_output)
+
+    return conversation.save(), conversation.turn
+
+
+def print_worker_stats(label: str):
+    from model_manager import model_manager
+    print(f"{label}: index cache {index_cache.stats()}")
+    print(f"{label}: embedding cache {model_manager.get_cache_stats()}")
+    print(f"{label}: encode batching {model_manager.get_batch_stats()}")
+    server_stats = model_manager.get_server_stats()
+    if server_stats:
+        print(f"{label}: embedding server {server_stats}")
+
+
+def load_turn_counts(log_path: str) -> dict:
+    path = os.path.join(log_path, TURN_COUNTS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_turn_counts(log_path: str, turn_counts: dict):
+    path = os.path.join(log_path, TURN_COUNTS_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(turn_counts, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def estimate_instance_cost(instance_id: str, info: dict, turn_counts: dict) -> float:
+    """Model turns of the previous run (or half of MAX_TURNS), weighted by database size in columns."""
+    store = get_document_store(determine_documents_path(instance_id))
+    columns = store.num_columns(info["db_name"]) if info["db_name"] in store else 0
+    return turn_counts.get(instance_id, MAX_TURNS / 2) * (1 + columns / COLUMNS_PER_TURN)
+
+
+def order_by_cost(instances: dict, turn_counts: dict) -> list:
+    """``(instance_id, info)`` pairs, most expensive first so the slow ones do not form the tail."""
+    return sorted(instances.items(), key=lambda item: -estimate_instance_cost(item[0], item[1], turn_counts))
+
+
+class InstanceProgress:
+    """Live queued/running/finished/failed counts of a complete_schema run.
+
+    Instances whose model output could not be parsed are not saved and are
+    counted as failed, like those that raised. Turn counts of every
+    conversation that ran are kept for the next run's cost estimates.
+    """
+
+    def __init__(self, total: int, turn_counts: dict):
+        self.queued = total
+        self.running = 0
+        self.finished = 0
+        self.failed = 0
+        self.turn_counts = turn_counts
+        self.bar = tqdm(total=total, desc="Instances")
+        self._refresh()
+
+    def start(self, instance_id: str):
+        self.queued -= 1
+        self.running += 1
+        self._refresh()
+
+    def finish(self, instance_id: str, saved: bool, turns: int):
+        self.turn_counts[instance_id] = turns
+        self.running -= 1
+        if saved:
+            self.finished += 1
+        else:
+            self.failed += 1
+        self.bar.update(1)
+        self._refresh()
+
+    def fail(self, instance_id: str, error: str):
+        self.running -= 1
+        self.failed += 1
+        print(f"Instance {instance_id} failed: {error}")
+        self.bar.update(1)
+        self._refresh()
+
+    def _refresh(self):
+        self.bar.set_postfix(queued=self.queued, running=self.running, finished=self.finished, failed=self.failed)
 
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-            )
-            model_output = response.choices[0].message.content
+    def close(self):
+        self.bar.close()
+        print(f"Instances: finished {self.finished}, failed {self.failed}, never started {self.queued}")
 
-            all_model_output += (f"Turn {i}\n" +
-                                 # "=============MODEL REASONING=============" +
-                                 # model_reason + "\n" +
-                                 # "=============MODEL OUTPUT=============" +
-                                 model_output + "\n" + "=" * 50 + "\n\n")
 
+def _instance_worker(task_queue, event_queue, log_path: str, budget: int = None):
+    """Pull instances from ``task_queue`` until the ``None`` sentinel, reporting to ``event_queue``."""
+    with open("spider2_data.json", "r", encoding="utf-8") as f:
+        spider2_data = json.load(f)
+
+    pid = os.getpid()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        instance_id, info = task
+        event_queue.put(("running", pid, instance_id, None))
+        try:
+            saved, turns = process_instance(instance_id, info, log_path, spider2_data, budget)
+            event_queue.put(("done", pid, instance_id, (saved, turns)))
+        except Exception as e:
+            event_queue.put(("failed", pid, instance_id, f"{type(e).__name__}: {e}"))
+
+    print_worker_stats(f"Thread {pid}")
+
+
+def run_process_engine(ordered_instances: list, log_path: str, num_workers: int, progress: InstanceProgress,
+                       budget: int = None):
+    """Spread instances over ``num_workers`` spawned processes that share one work queue.
+
+    Workers take the next instance whenever they finish one, so no worker
+    idles while instances are queued; an instance whose worker died is
+    counted as failed.
+    """
+    ctx = mp.get_context("spawn")
+    task_queue, event_queue = ctx.Queue(), ctx.Queue()
+    for task in ordered_instances:
+        task_queue.put(task)
+    num_workers = max(1, min(num_workers, len(ordered_instances)))
+    for _ in range(num_workers):
+        task_queue.put(None)
+
+    workers = [ctx.Process(target=_instance_worker, args=(task_queue, event_queue, log_path, budget))
+               for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    running = {}
+    remaining = len(ordered_instances)
+    while remaining:
+        try:
+            kind, pid, instance_id, payload = event_queue.get(timeout=10)
+        except queue.Empty:
+            for worker in workers:
+                if not worker.is_alive() and worker.pid in running:
+                    progress.fail(running.pop(worker.pid), f"worker {worker.pid} exited with code {worker.exitcode}")
+                    remaining -= 1
+            if remaining and not any(worker.is_alive() for worker in workers):
+                print(f"All workers exited with {remaining} instances left")
+                break
+            continue
+        if kind == "running":
+            running[pid] = instance_id
+            progress.start(instance_id)
+            continue
+        running.pop(pid, None)
+        remaining -= 1
+        if kind == "done":
+            progress.finish(instance_id, *payload)
+        else:
+            progress.fail(instance_id, payload)
+
+    for worker in workers:
+        worker.join()
+
+
+class AsyncSchemaEngine:
+    """Drive many instance conversations concurrently on one event loop.
+
+    Up to ``max_instances`` conversations are active at once and at most
+    ``llm_concurrency`` chat requests are in flight, so throughput is bound
+    by the LLM endpoint rather than by a process count. Tool calls run in
+    bounded thread pools: retrieval (embedding + FAISS, shared in-process
+    model and index caches) in ``retrieval_threads`` and SQL, which mostly
+    waits on the database, in ``sql_threads``. Tool calls of one
+    conversation still run in order, since retrieval state is per instance.
+    """
+
+    def __init__(self, log_path: str, max_instances: int = None, llm_concurrency: int = None,
+                 retrieval_threads: int = None, sql_threads: int = None, budget: int = None):
+        if max_instances is None:
+            max_instances = int(os.environ.get("AUTOLINK_MAX_INSTANCES", DEFAULT_MAX_INSTANCES))
+        if llm_concurrency is None:
+            llm_concurrency = int(os.environ.get("AUTOLINK_LLM_CONCURRENCY", DEFAULT_LLM_CONCURRENCY))
+        if retrieval_threads is None:
+            retrieval_threads = int(os.environ.get("AUTOLINK_RETRIEVAL_THREADS", DEFAULT_RETRIEVAL_THREADS))
+        if sql_threads is None:
+            sql_threads = int(os.environ.get("AUTOLINK_SQL_THREADS", DEFAULT_SQL_THREADS))
+        self.log_path = log_path
+        self.max_instances = max_instances
+        self.llm_concurrency = llm_concurrency
+        self.retrieval_threads = retrieval_threads
+        self.sql_threads = sql_threads
+        self.budget = budget
+        self.llm_requests = 0
+        self.llm_in_flight = 0
+        self.max_llm_in_flight = 0
+        self.llm_latencies = []
+        self.tool_calls = 0
+
+    async def chat(self, messages: list) -> str:
+        async with self.llm_semaphore:
+            self.llm_in_flight += 1
+            self.max_llm_in_flight = max(self.max_llm_in_flight, self.llm_in_flight)
+            start = time.perf_counter()
             try:
-                full_lines, tool_calls = parse_model_output(model_output)
+                response = await self.client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                )
+            finally:
+                self.llm_in_flight -= 1
+            self.llm_requests += 1
+            self.llm_latencies.append(time.perf_counter() - start)
+        return response.choices[0].message.content
+
+    async def run_tool(self, pool, func, *args):
+        self.tool_calls += 1
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+    async def run_instance(self, instance_id: str, info: dict, spider2_data: dict, progress: InstanceProgress):
+        async with self.instance_semaphore:
+            progress.start(instance_id)
+            try:
+                saved, turns = await self.converse(instance_id, info, spider2_data)
             except Exception as e:
-                full_lines = []
-                tool_calls = []
-                is_error = True
+                # One failing conversation must not take the others down.
+                progress.fail(instance_id, f"{type(e).__name__}: {e}")
+            else:
+                progress.finish(instance_id, saved, turns)
 
-                with open(os.path.join(error_path, instance_id) + '.txt', "w", encoding="utf-8") as f:
-                    f.write(model_output)
+    async def converse(self, instance_id: str, info: dict, spider2_data: dict):
+        conversation = await asyncio.get_running_loop().run_in_executor(
+            self.retrieval_pool, InstanceConversation, instance_id, info, self.log_path, spider2_data, self.budget)
 
+        while conversation.next_turn():
+            model_output = await self.chat(conversation.messages)
 
-            func_messages = ""
-            
-            for line, func in zip(full_lines, tool_calls):
-                
+            for line, func in conversation.parse_output(model_output):
                 if func["tool"] == "stop":
-                    is_finished = True
+                    conversation.is_finished = True
                     break
                 elif func["tool"] == "schema_retrieval":
-                    
-                    is_complete = False
-                    
-                    table = func["table"]
-                    column = func["column"]
-                    description = func["description"]
-
-                    if table == "" and column == "" and description == "":
-                        continue
-                    
-                    if is_complete:
-                        continue
-
-                    func_messages += f"Tool: {line} \n The tool returns the following results:"
-
-                    retrieve_content = "column name: " + column + "\n" + \
-                                       "table name: " + table + "\n" + \
-                                       "description: " + description
-
-                    semantic_results, metadata_mapping, text = get_next_k_results(
-                        instance_id=instance_id,
-                        question=retrieve_content,
-                        db_name=db_name,
-                        embed_path=embed_path,
-                        top_k=3,
-                        cache_dir=cache_path,
-                        status_dir=status_path,
-                        device="cuda:0")
-
-                    new_results = ""
-                    for result in semantic_results:
-                        metadata = result["metadata"]
-                        table = metadata["table"]
-                        column = metadata["column"]
-                        description = metadata["description"]
-                        column_type = metadata["column_type"]
-                        column_value = metadata["column_value"]
-                        func_messages += f"{description}\n"
-                        new_results += f"{description}\n"
-                        column_candidates.append(column)
-                        table_candidates.append(table)
-                        column_type_candidates.append(column_type)
-                        column_value_candidates.append(column_value)
-                        description_candidates.append(description)
-
-                    if text:
-                        is_complete = True
-                        func_messages += f"{text}\n"
-                    func["result"] = new_results
-                    func_messages += "\n"
-
+                    retrieve_content = conversation.retrieval_query(line, func)
+                    if retrieve_content is not None:
+                        conversation.retrieval_result(
+                            func, *await self.run_tool(self.retrieval_pool, conversation.retrieve, retrieve_content))
                 elif func["tool"] == "sql_execution" or func["tool"] == "sql_draft":
-
-                    query = func["query"]
-
-                    if query == "":
-                        continue
-                    func_messages += f"Tool: {line} \n The tool returns the following results:\n"
-                    exec_status, results = thread_safe_sql_execution(instance_id, query, db_name)         
-                    func_messages += f"{results}\n\n"
-                    func["result"] = str(results)
-                    
-            all_calls[f"turn_{i}"] = tool_calls
-            func_messages += "\nFor `@sql_execution`, if the results return column names or table names including the missing tables or columns you think, in this turn, you must use the @schema_retrieval tool to retrieve the missing tables or columns.\nBecause we will use initial schema and the results of `@sql_execution` tool as the final schema. Please do not think that the columns obtained by @sql_execution will be recalled. Only the columns obtained by `@schema_retrieval` can be considered to be recalled correctly.\nPlease also pay attention to the column name like `*id`, `*name`, `*text`, `*code` and so on. These columns are often crucial for final SQL construction, especially for joins, filtering, and output.\nYou also need to pay attention that Some important columns may exist in more than one table, but the initial schema may include only one instance. This can cause critical tables to be omitted if you're not careful. Always check whether a column name is shared across tables, and whether the other tables containing it also provide relevant context for the question."
-
-            messages.append({"role": "assistant", "content": model_output})
-            messages.append({"role": "user", "content": func_messages})
-
-        each_candidates[instance_id] = {
-            "question": question,
-            "db_name": db_name,
-            "column_candidates": column_candidates,
-            "column_types": column_type_candidates,
-            "column_values": column_value_candidates,
-            "table_candidates": table_candidates,
-            "descriptions": description_candidates,
+                    query = conversation.sql_query(line, func)
+                    if query is not None:
+                        conversation.sql_result(func, *await self.run_tool(self.sql_pool, conversation.execute, query))
+
+            conversation.end_turn(model_output)
+
+        return conversation.save(), conversation.turn
+
+    async def run(self, ordered_instances: list, spider2_data: dict, progress: InstanceProgress):
+        """Run ``(instance_id, info)`` pairs; the semaphore admits them in the given order."""
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), base_url=os.environ.get("OPENAI_BASE_URL"))
+        self.instance_semaphore = asyncio.Semaphore(self.max_instances)
+        self.llm_semaphore = asyncio.Semaphore(self.llm_concurrency)
+
+        start_time = time.time()
+        with ThreadPoolExecutor(self.retrieval_threads, thread_name_prefix="retrieval") as self.retrieval_pool, \
+                ThreadPoolExecutor(self.sql_threads, thread_name_prefix="sql") as self.sql_pool:
+            await asyncio.gather(*(self.run_instance(instance_id, info, spider2_data, progress)
+                                   for instance_id, info in ordered_instances))
+            await self.client.close()
+
+        print(f"Async engine: {len(ordered_instances)} instances in {time.time() - start_time:.1f}s; {self.stats()}")
+        print_worker_stats("Async engine")
+
+    def stats(self):
+        latencies = np.array(self.llm_latencies) if self.llm_latencies else np.zeros(1)
+        return {
+            "llm_requests": self.llm_requests,
+            "max_llm_in_flight": self.max_llm_in_flight,
+            "llm_mean_s": round(float(latencies.mean()), 2),
+            "llm_p95_s": round(float(np.percentile(latencies, 95)), 2),
+            "tool_calls": self.tool_calls,
         }
 
-        if is_error:
-            print(f"Error occurred for instance {instance_id}. Skipping...")
-            continue
-
-        with open(os.path.join(model_output_path, instance_id) + '.txt', "w", encoding="utf-8") as f:
-            f.write(all_model_output)
-            
-        with open(os.path.join(tool_calls_path, instance_id) + '.json', "w", encoding="utf-8") as f:
-            json.dump(all_calls, f, ensure_ascii=False, indent=2)
-
-        with open(os.path.join(input_path, instance_id) + '.txt', "w", encoding="utf-8") as f:
-            f.write(all_inputs)
-
-        with open(os.path.join(candidates_path, instance_id) + '.json', "w", encoding="utf-8") as f:
-            json.dump(each_candidates, f, ensure_ascii=False, indent=2)
-
 
-def complete_schema(log_path, num_threads=3):
+def complete_schema(log_path, num_threads=3, engine="async", max_instances=None, llm_concurrency=None):
     
-    status_dir = os.path.join(log_path, "status")
+    state_store = get_state_store(log_path)
     
-    """Complete schema using multithreading approach"""
+    """Complete schema with the async engine (default) or ``num_threads`` worker processes"""
     model_output_path = os.path.join(log_path, "model_output")
     os.makedirs(model_output_path, exist_ok=True)
 
@@ -433,15 +727,16 @@ def complete_schema(log_path, num_threads=3):
     instance_ids = list(spider2_data.keys())
     
     print("Backup instance status ...")
-    for instance_id in instance_ids:
-        backup_instance_state(instance_id, log_path)
+    with state_store.transaction():
+        for instance_id in instance_ids:
+            backup_instance_state(instance_id, log_path)
     
+    all_status = state_store.load_all_status()
     clean_instance_ids = []
     for instance_id in instance_ids:
         if os.path.exists(os.path.join(candidates_path, instance_id) + '.json'):
             continue
-        with open(os.path.join(status_dir, instance_id + ".json"), "r", encoding="utf-8") as f:
-            cache_data = json.load(f)
+        cache_data = all_status[instance_id]
         
         if cache_data.get("is_complete", False):
             continue
@@ -456,38 +751,38 @@ def complete_schema(log_path, num_threads=3):
     
     instance_ids = clean_instance_ids
 
-    batch_size = max(1, len(instance_ids) // num_threads)
-    batches = []
-
-    for i in range(0, len(instance_ids), batch_size):
-        end_idx = min(i + batch_size, len(instance_ids))
-        batch = {instance_id: initial_candidates[instance_id] for instance_id in instance_ids[i:end_idx]}
-        batches.append(batch)
-
-    num_threads = min(num_threads, len(batches))
-
-    mp.set_start_method('spawn', force=True)
-
-    # Start processes
-    processes = []
-    target_function = process_instance_batch
-    for i in range(num_threads):
-        if i < len(batches):
-            p = mp.Process(
-                target=target_function,
-                args=(batches[i], log_path)
-            )
-            processes.append(p)
-            p.start()
-
-    # Wait for all processes to finish
-    for p in processes:
-        p.join()
-        
+    # Shard the documents once here, so worker processes only open per-database files.
+    for documents_path in sorted({determine_documents_path(instance_id) for instance_id in instance_ids}):
+        get_document_store(documents_path)
+
+    turn_counts = load_turn_counts(log_path)
+    ordered_instances = order_by_cost({instance_id: initial_candidates[instance_id] for instance_id in instance_ids},
+                                      turn_counts)
+    # Trim ALL_TABLES and the knowledge under the budget the schema prompts were fitted to.
+    budget = recorded_budget(log_path)
+    progress = InstanceProgress(len(ordered_instances), turn_counts)
+    try:
+        if engine == "async":
+            engine = AsyncSchemaEngine(log_path, max_instances=max_instances, llm_concurrency=llm_concurrency,
+                                       budget=budget)
+            asyncio.run(engine.run(ordered_instances, spider2_data, progress))
+        else:
+            run_process_engine(ordered_instances, log_path, num_threads, progress, budget)
+    finally:
+        progress.close()
+        save_turn_counts(log_path, turn_counts)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--log_path', type=str, default="log_v3_topn100")
+    parser.add_argument('--engine', type=str, default="async", choices=["async", "process"])
+    parser.add_argument('--num_threads', type=int, default=8, help="worker processes of the process engine")
+    parser.add_argument('--max_instances', type=int, default=None,
+                        help="conversations in flight in the async engine (default AUTOLINK_MAX_INSTANCES)")
+    parser.add_argument('--llm_concurrency', type=int, default=None,
+                        help="chat requests in flight in the async engine (default AUTOLINK_LLM_CONCURRENCY)")
     args = parser.parse_args()
     print("Starting schema completion...")
-    complete_schema(args.log_path, num_threads=8)
+    complete_schema(args.log_path, num_threads=args.num_threads, engine=args.engine,
+                    max_instances=args.max_instances, llm_concurrency=args.llm_concurrency)
     print("Schema completion finished.")
@@ -0,0 +1,177 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+
+DOCUMENT_INDEX_FILE = "index.json"
+# Shards are "<db>.db.json", a name no database can give to the index file.
+SHARD_SUFFIX = ".db.json"
+DEFAULT_CACHE_DBS = 4
+
+
+def shard_dir_for(documents_path: str) -> str:
+    """``documents/bigquery.json`` is sharded into ``documents/bigquery/``."""
+    if documents_path.endswith(".json"):
+        return documents_path[:-len(".json")]
+    return documents_path
+
+
+def _iter_monolithic(path: str):
+    """Yield ``(db_name, tables)`` from a monolithic documents file.
+
+    Uses ijson to parse one database at a time when it is installed;
+    otherwise the file is loaded once.
+    """
+    try:
+        import ijson
+    except ImportError:
+        print(f"Warning: ijson is not installed, loading all of {path} into memory to shard it "
+              f"(pip install ijson)")
+        ijson = None
+    with open(path, "rb") as f:
+        if ijson is not None:
+            yield from ijson.kvitems(f, "", use_float=True)
+        else:
+            yield from json.load(f).items()
+
+
+def write_document_shard(shard_dir: str, db_name: str, tables: dict) -> dict:
+    """Write one database shard atomically and return its index entry."""
+    os.makedirs(shard_dir, exist_ok=True)
+    file_name = f"{db_name}{SHARD_SUFFIX}"
+    path = os.path.join(shard_dir, file_name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(tables, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return {
+        "file": file_name,
+        "tables": len(tables),
+        "columns": sum(len(table_info["columns"]) for table_info in tables.values()),
+        "bytes": os.path.getsize(path),
+    }
+
+
+def write_document_index(shard_dir: str, databases: dict, source: dict = None):
+    path = os.path.join(shard_dir, DOCUMENT_INDEX_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "databases": databases}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def remove_stale_shards(shard_dir: str, databases: dict) -> list:
+    """Delete shard files that are not referenced by the ``databases`` index entries."""
+    keep = {entry["file"] for entry in databases.values()}
+    removed = []
+    for file_name in os.listdir(shard_dir):
+        if file_name.endswith(".json") and file_name != DOCUMENT_INDEX_FILE and file_name not in keep:
+            os.remove(os.path.join(shard_dir, file_name))
+            removed.append(file_name)
+    return removed
+
+
+def _source_signature(path: str):
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def shard_documents(documents_path: str, shard_dir: str = None) -> str:
+    """Split a monolithic documents file into one shard per database plus an index."""
+    shard_dir = shard_dir or shard_dir_for(documents_path)
+    databases = {}
+    for db_name, tables in _iter_monolithic(documents_path):
+        databases[db_name] = write_document_shard(shard_dir, db_name, tables)
+    write_document_index(shard_dir, databases, _source_signature(documents_path))
+    remove_stale_shards(shard_dir, databases)
+    return shard_dir
+
+
+class DocumentStore:
+    """Per-database access to a sharded documents directory.
+
+    Only the shards that are asked for are parsed, and at most
+    ``max_cached`` (AUTOLINK_DOCUMENT_CACHE_DBS) recently used databases
+    stay in memory.
+    """
+
+    def __init__(self, shard_dir: str, max_cached: int = None):
+        if max_cached is None:
+            max_cached = int(os.environ.get("AUTOLINK_DOCUMENT_CACHE_DBS", DEFAULT_CACHE_DBS))
+        self.shard_dir = shard_dir
+        self.max_cached = max_cached
+        with open(os.path.join(shard_dir, DOCUMENT_INDEX_FILE), "r", encoding="utf-8") as f:
+            self.index = json.load(f)["databases"]
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def db_names(self) -> list:
+        return list(self.index)
+
+    def num_columns(self, db_name: str) -> int:
+        return self.index[db_name]["columns"]
+
+    def load(self, db_name: str) -> dict:
+        with self.lock:
+            if db_name in self.cache:
+                self.cache.move_to_end(db_name)
+                return self.cache[db_name]
+        tables = self.read(db_name)
+        with self.lock:
+            self.cache[db_name] = tables
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return tables
+
+    def read(self, db_name: str) -> dict:
+        """Parse one database shard without caching it."""
+        if db_name not in self.index:
+            raise KeyError(f"Database {db_name} not found in {self.shard_dir}")
+        with open(os.path.join(self.shard_dir, self.index[db_name]["file"]), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def items(self):
+        """Yield ``(db_name, tables)`` one database at a time, without caching."""
+        for db_name in self.index:
+            yield db_name, self.read(db_name)
+
+    def __contains__(self, db_name):
+        return db_name in self.index
+
+    def __getitem__(self, db_name):
+        return self.load(db_name)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def _is_stale(documents_path: str, shard_dir: str) -> bool:
+    index_path = os.path.join(shard_dir, DOCUMENT_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return True
+    if not documents_path.endswith(".json") or not os.path.exists(documents_path):
+        return False
+    with open(index_path, "r", encoding="utf-8") as f:
+        source = json.load(f).get("source")
+    return source is not None and source != _source_signature(documents_path)
+
+
+def open_document_store(documents_path: str) -> DocumentStore:
+    """Open the shards of ``documents_path``, (re)building them from the monolithic file if needed."""
+    shard_dir = shard_dir_for(documents_path)
+    if _is_stale(documents_path, shard_dir):
+        shard_documents(documents_path, shard_dir)
+    return DocumentStore(shard_dir)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_document_store(documents_path: str) -> DocumentStore:
+    key = os.path.abspath(documents_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = open_document_store(documents_path)
+        return _stores[key]
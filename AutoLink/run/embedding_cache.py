@@ -0,0 +1,92 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+DEFAULT_CACHE_ENTRIES = 20000
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of text embeddings keyed by model and text hash.
+
+    When ``path`` (or AUTOLINK_EMBED_CACHE_PATH) is set, entries are also
+    persisted to a SQLite file shared by all processes and runs.
+    """
+
+    def __init__(self, max_entries: int = None, path: str = None):
+        if max_entries is None:
+            max_entries = int(os.environ.get("AUTOLINK_EMBED_CACHE_SIZE", DEFAULT_CACHE_ENTRIES))
+        if path is None:
+            path = os.environ.get("AUTOLINK_EMBED_CACHE_PATH") or None
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None and self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self.conn.commit()
+        return self.conn
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return model_name + ":" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            conn = self._connect()
+            if conn is not None:
+                row = conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._put(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector):
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        with self.lock:
+            self._put(key, vector)
+            conn = self._connect()
+            if conn is not None:
+                conn.execute("INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)", (key, vector.tobytes()))
+                conn.commit()
+        return vector
+
+    def _put(self, key: str, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+                "entries": len(self.entries),
+            }
@@ -5,6 +5,14 @@ import numpy as np
 import faiss
 from tqdm import tqdm
 import time
+import queue
+import shutil
+import hashlib
+import argparse
+import multiprocessing as mp
+from index_cache import INDEX_PARAMS_FILE
+from metadata_store import METADATA_BIN_FILE, write_metadata_store
+from document_store import get_document_store
 
 
 BIGQUERY_PATH = "resource/databases/bigquery"
@@ -13,70 +21,471 @@ LOCALDB_PATH = "resource/databases/sqlite"
 
 DBS_PATH = [BIGQUERY_PATH, SNOWFLAKE_PATH, LOCALDB_PATH]
 
-def embed_documents(input_file: str, embed_path: str, batch_size: int = 32):
-    os.makedirs(embed_path, exist_ok=True)
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+EMBED_MANIFEST_FILE = "embed_manifest.json"
+VECTORS_FILE = "vectors.npy"
 
-    model = SentenceTransformer("BAAI/bge-large-en-v1.5")
+INDEX_TYPES = ["auto", "flat", "ivf_flat", "hnsw", "ivf_pq"]
+STORAGE_MODES = ["float32", "float16", "int8"]
+SCALAR_QUANTIZERS = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
 
-    with open(input_file, "r", encoding="utf-8") as f:
-        documents = json.load(f)
+# Column-count thresholds used by index_type="auto".
+HNSW_MIN_COLUMNS = 20000
+IVF_FLAT_MIN_COLUMNS = 100000
+IVF_PQ_MIN_COLUMNS = 1000000
 
-    log = {}
 
-    for db_name, tables in tqdm(documents.items()):
+def choose_index_type(num_vectors: int) -> str:
+    if num_vectors >= IVF_PQ_MIN_COLUMNS:
+        return "ivf_pq"
+    if num_vectors >= IVF_FLAT_MIN_COLUMNS:
+        return "ivf_flat"
+    if num_vectors >= HNSW_MIN_COLUMNS:
+        return "hnsw"
+    return "flat"
 
+
+def build_index(embeddings: np.ndarray, index_type: str = "auto", storage: str = "float32"):
+    num_vectors, dimension = embeddings.shape
+    if index_type == "auto":
+        index_type = choose_index_type(num_vectors)
+
+    params = {"index_type": index_type, "dimension": dimension, "ntotal": num_vectors, "storage": storage}
+
+    # Compact storage modes search unit vectors by inner product, which keeps
+    # the quantization range fixed and the ranking equal to cosine similarity.
+    if storage == "float32":
+        metric = faiss.METRIC_L2
+    else:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).copy()
+        faiss.normalize_L2(embeddings)
+        metric = faiss.METRIC_INNER_PRODUCT
+        params.update({"metric": "inner_product", "normalize": True})
+    qtype = SCALAR_QUANTIZERS.get(storage)
+
+    if index_type == "flat":
+        if qtype is None:
+            index = faiss.IndexFlat(dimension, metric)
+        else:
+            index = faiss.IndexScalarQuantizer(dimension, qtype, metric)
+    elif index_type == "hnsw":
+        params.update({"M": 32, "efConstruction": 200, "efSearch": 128})
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dimension, params["M"], metric)
+        else:
+            index = faiss.IndexHNSWSQ(dimension, qtype, params["M"], metric)
+        index.hnsw.efConstruction = params["efConstruction"]
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        # ~39 training points per list are needed, so small inputs get fewer lists.
+        nlist = max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+        params.update({"nlist": nlist, "nprobe": min(nlist, max(8, nlist // 16))})
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if index_type == "ivf_pq":
+            pq_m = next(m for m in (64, 32, 16, 8, 4, 2, 1) if dimension % m == 0)
+            pq_nbits = min(8, max(1, int(np.log2(max(2, num_vectors // 39)))))
+            params.update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, params["pq_nbits"], metric)
+        elif qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, qtype, metric)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index, params
+
+
+def document_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_embed_manifest(db_dir: str):
+    path = os.path.join(db_dir, EMBED_MANIFEST_FILE)
+    if not os.path.exists(path) or not os.path.exists(os.path.join(db_dir, VECTORS_FILE)):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def collect_columns(db_name: str, tables: dict):
+    all_descriptions = []
+    metadata_mapping = []
+
+    for table_name, table_info in tables.items():
+        columns = table_info["columns"]
+        column_types = table_info["column_types"]
+        column_values = table_info["sample_values"]
+        
+        if len(columns) != len(column_types) or len(columns) != len(column_values) or len(column_types) != len(column_values):
+            print(f"Warning: Length mismatch in table {table_name} of database {db_name}.")
+            print(f"Columns: {len(columns)}, Column Types: {len(column_types)}, Column Values: {len(column_values)}")
+        
+        for (column_name, desc), column_type, column_value in zip(columns.items(), column_types, column_values):
+            all_descriptions.append(desc)
+            metadata_mapping.append({
+                "table": table_name,
+                "column": column_name,
+                "column_type": column_type,
+                "column_value": column_value,
+                "description": desc
+            })
+
+    return all_descriptions, metadata_mapping
+
+
+def encode_documents(encode, texts: list, batch_size: int, desc: str = None):
+    """Encode each distinct text once, in batches of similar length.
+
+    Sharded tables repeat the same column descriptions, so duplicates share one
+    vector. Sorting by length before batching keeps short and long texts out of
+    the same padded batch. Returns one vector per input text and the number of
+    texts actually encoded.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    order = sorted(range(len(unique_texts)), key=lambda i: len(unique_texts[i]))
+    unique_embeddings = [None] * len(unique_texts)
+    for i in tqdm(range(0, len(order), batch_size), desc=desc, leave=False):
+        batch = order[i:i + batch_size]
+        for j, embedding in zip(batch, encode([unique_texts[j] for j in batch])):
+            unique_embeddings[j] = embedding
+    unique_embeddings = np.array(unique_embeddings, dtype=np.float32)
+    position = {text: i for i, text in enumerate(unique_texts)}
+    return unique_embeddings[[position[text] for text in texts]], len(unique_texts)
+
+
+def embed_database(encode, db_name: str, tables: dict, db_dir: str, batch_size: int = 32, index_type: str = "auto",
+                   storage: str = "float32", model_name: str = EMBED_MODEL, full: bool = False):
+    """Embed one database, reusing vectors of unchanged column documents.
+
+    ``embed_manifest.json`` records a hash per column document and the row of
+    its vector in ``vectors.npy``. Documents whose hash is already in the
+    manifest reuse that vector; only new or changed ones are passed to
+    ``encode``. A database whose content and build settings are unchanged is
+    not rewritten at all.
+    """
+    all_descriptions, metadata_mapping = collect_columns(db_name, tables)
+    content_hash = document_hash(json.dumps([metadata_mapping, model_name, index_type, storage], ensure_ascii=False))
+    doc_hashes = [document_hash(desc) for desc in all_descriptions]
+    stats = {"columns": len(metadata_mapping), "encoded": 0, "unique": 0, "reused": 0, "deleted": 0,
+             "rewritten": False, "encode_seconds": 0.0}
+
+    manifest = None if full else load_embed_manifest(db_dir)
+    if manifest is not None and manifest.get("model") != model_name:
+        manifest = None
+    if manifest is not None and manifest["content_hash"] == content_hash and all(
+            os.path.exists(os.path.join(db_dir, name))
+            for name in ("index.faiss", INDEX_PARAMS_FILE, "metadata.json", METADATA_BIN_FILE)):
+        stats["reused"] = len(metadata_mapping)
+        with open(os.path.join(db_dir, INDEX_PARAMS_FILE), "r", encoding="utf-8") as f_params:
+            stats["index_bytes"] = json.load(f_params).get("index_bytes", 0)
+        return stats
+
+    old_vectors = None
+    old_rows = {}
+    if manifest is not None:
+        old_vectors = np.load(os.path.join(db_dir, VECTORS_FILE), mmap_mode="r")
+        old_rows = {entry["hash"]: entry["vector_id"] for entry in manifest["columns"]}
+        stats["deleted"] = len(set(old_rows) - set(doc_hashes))
+
+    missing = [i for i, doc_hash in enumerate(doc_hashes) if doc_hash not in old_rows]
+    embeddings = None
+    if missing:
+        start_time = time.time()
+        new_embeddings, stats["unique"] = encode_documents(encode, [all_descriptions[i] for i in missing], batch_size,
+                                                           desc=f"Embedding {db_name}")
+        stats["encode_seconds"] = time.time() - start_time
+        embeddings = np.zeros((len(metadata_mapping), new_embeddings.shape[1]), dtype=np.float32)
+        embeddings[missing] = new_embeddings
+    reused = [i for i, doc_hash in enumerate(doc_hashes) if doc_hash in old_rows]
+    if reused:
+        if embeddings is None:
+            embeddings = np.zeros((len(metadata_mapping), old_vectors.shape[1]), dtype=np.float32)
+        embeddings[reused] = old_vectors[[old_rows[doc_hashes[i]] for i in reused]]
+    stats["encoded"] = len(missing)
+    stats["reused"] = len(reused)
+
+    if embeddings is None:
+        raise ValueError(f"No columns to embed in database {db_name}")
+    del old_vectors
+
+    index, index_params = build_index(embeddings, index_type=index_type, storage=storage)
+
+    # Drop the manifest first: if the build stops midway, the next run rebuilds
+    # this database instead of pairing the old manifest with new vectors.
+    manifest_path = os.path.join(db_dir, EMBED_MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    _atomic_write(os.path.join(db_dir, VECTORS_FILE), lambda path: _save_npy(path, embeddings))
+    _atomic_write(os.path.join(db_dir, "index.faiss"), lambda path: faiss.write_index(index, path))
+    index_params["index_bytes"] = os.path.getsize(os.path.join(db_dir, "index.faiss"))
+    _atomic_write(os.path.join(db_dir, INDEX_PARAMS_FILE), _json_writer(index_params, indent=2))
+    _atomic_write(os.path.join(db_dir, "metadata.json"), _json_writer(metadata_mapping, indent=2))
+    write_metadata_store(os.path.join(db_dir, METADATA_BIN_FILE), metadata_mapping)
+    _atomic_write(manifest_path, _json_writer({
+        "model": model_name,
+        "content_hash": content_hash,
+        "columns": [{"table": metadata["table"], "column": metadata["column"], "hash": doc_hash, "vector_id": i}
+                    for i, (metadata, doc_hash) in enumerate(zip(metadata_mapping, doc_hashes))]
+    }))
+
+    stats["rewritten"] = True
+    stats["index_bytes"] = index_params["index_bytes"]
+    return stats
+
+
+def _atomic_write(path: str, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _save_npy(path: str, array: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def _json_writer(data, indent: int = None):
+    def write(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+    return write
+
+
+def remove_stale_databases(embed_path: str, db_names) -> list:
+    """Delete embedding directories built by this script for databases no longer in the documents."""
+    removed = []
+    for db_name in sorted(os.listdir(embed_path)):
         db_dir = os.path.join(embed_path, db_name)
-        os.makedirs(db_dir, exist_ok=True)
-
-        all_descriptions = []
-        metadata_mapping = []
-
-        for table_name, table_info in tables.items():
-            columns = table_info["columns"]
-            column_types = table_info["column_types"]
-            column_values = table_info["sample_values"]
-            
-            if len(columns) != len(column_types) or len(columns) != len(column_values) or len(column_types) != len(column_values):
-                print(f"Warning: Length mismatch in table {table_name} of database {db_name}.")
-                print(f"Columns: {len(columns)}, Column Types: {len(column_types)}, Column Values: {len(column_values)}")
-            
-            for (column_name, desc), column_type, column_value in zip(columns.items(), column_types, column_values):
-                all_descriptions.append(desc)
-                metadata_mapping.append({
-                    "table": table_name,
-                    "column": column_name,
-                    "column_type": column_type,
-                    "column_value": column_value,
-                    "description": desc
-                })
-
-        log[db_name] = len(metadata_mapping)
-
-        db_embeddings = []
-        for i in tqdm(range(0, len(all_descriptions), batch_size), desc=f"Embedding {db_name}", leave=False):
-            batch_descriptions = all_descriptions[i:i + batch_size]
-            batch_embeddings = model.encode(batch_descriptions, convert_to_numpy=True)
-            db_embeddings.extend(batch_embeddings)
-
-        assert len(db_embeddings) == len(metadata_mapping)
-
-        dimension = len(db_embeddings[0])
-        index = faiss.IndexFlatL2(dimension)
-        index.add(np.array(db_embeddings, dtype=np.float32))
-
-        faiss.write_index(index, os.path.join(db_dir, "index.faiss"))
-
-        with open(os.path.join(db_dir, "metadata.json"), "w", encoding="utf-8") as f_meta:
-            json.dump(metadata_mapping, f_meta, ensure_ascii=False, indent=2)
+        if db_name not in db_names and os.path.exists(os.path.join(db_dir, EMBED_MANIFEST_FILE)):
+            shutil.rmtree(db_dir)
+            removed.append(db_name)
+    return removed
+
+
+def default_devices() -> list:
+    import torch
+    if torch.cuda.is_available():
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return ["cpu"]
+
+
+def _lazy_encoder(device: str = None):
+    model = None
+
+    def encode(texts):
+        nonlocal model
+        if model is None:
+            model = SentenceTransformer(EMBED_MODEL, device=device)
+        return model.encode(texts, convert_to_numpy=True)
+
+    return encode
+
+
+def _embed_task(encode, embed_path: str, db_name: str, shard_dir: str, options: dict):
+    db_dir = os.path.join(embed_path, db_name)
+    os.makedirs(db_dir, exist_ok=True)
+    start_time = time.time()
+    tables = get_document_store(shard_dir).read(db_name)
+    stats = embed_database(encode, db_name, tables, db_dir, **options)
+    stats["seconds"] = time.time() - start_time
+    return stats
+
+
+def _embed_worker(device: str, task_queue, result_queue, options: dict):
+    encode = _lazy_encoder(device)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        embed_path, db_name, shard_dir = task
+        try:
+            result = (embed_path, db_name, _embed_task(encode, embed_path, db_name, shard_dir, options), None)
+        except Exception as e:
+            result = (embed_path, db_name, None, f"{type(e).__name__}: {e}")
+        result_queue.put((os.getpid(), result))
+
+
+def _run_embed_tasks(tasks: list, options: dict, num_workers: int, devices: list, retries: int):
+    """Run (embed_path, db_name, shard_dir) tasks, retrying failed databases up to ``retries`` times.
+
+    With ``num_workers`` > 1 the databases are spread over spawned worker
+    processes, assigned round-robin to ``devices``; otherwise they run here.
+    A worker that dies (OOM, CUDA abort) fails its database like an
+    exception would, and is replaced by a fresh process on the same device.
+    Returns per-database stats and the last error of databases that never succeeded.
+    """
+    results, failures = {}, {}
+    attempts = {task[:2]: 0 for task in tasks}
+    tasks_by_key = {task[:2]: task for task in tasks}
+    progress = tqdm(total=len(tasks), desc="Embedding databases")
+
+    def handle(embed_path, db_name, stats, error):
+        """Record one result; returns True if the database should be retried."""
+        key = (embed_path, db_name)
+        if error is None:
+            results[key] = stats
+            failures.pop(key, None)
+            progress.set_postfix_str(f"{db_name} {stats['seconds']:.1f}s")
+        else:
+            failures[key] = error
+            attempts[key] += 1
+            if attempts[key] <= retries:
+                print(f"Embedding {db_name} failed ({error}), retry {attempts[key]}/{retries}")
+                return True
+            print(f"Embedding {db_name} failed after {attempts[key]} attempts: {error}")
+        progress.update(1)
+        return False
+
+    if num_workers <= 1:
+        encode = _lazy_encoder(devices[0] if devices else None)
+        pending = list(tasks)
+        while pending:
+            embed_path, db_name, shard_dir = pending.pop(0)
+            try:
+                retry = handle(embed_path, db_name, _embed_task(encode, embed_path, db_name, shard_dir, options), None)
+            except Exception as e:
+                retry = handle(embed_path, db_name, None, f"{type(e).__name__}: {e}")
+            if retry:
+                pending.append(tasks_by_key[(embed_path, db_name)])
+    else:
+        devices = devices or default_devices()
+        ctx = mp.get_context("spawn")
+        result_queue = ctx.Queue()
+        pending = list(tasks)
+        # Each worker gets its own task queue and one database at a time, so the
+        # database a dead worker was on is known here without any message from it.
+        workers, assigned = {}, {}
+
+        def start_worker(device):
+            task_queue = ctx.Queue()
+            worker = ctx.Process(target=_embed_worker, args=(device, task_queue, result_queue, options))
+            worker.start()
+            workers[worker.pid] = (worker, device, task_queue)
+
+        def dispatch():
+            for pid, (_, _, task_queue) in workers.items():
+                if pending and pid not in assigned:
+                    task = pending.pop(0)
+                    assigned[pid] = task[:2]
+                    task_queue.put(task)
+
+        for i in range(num_workers):
+            start_worker(devices[i % len(devices)])
+        dispatch()
+
+        remaining = len(tasks)
+        while remaining:
+            try:
+                pid, result = result_queue.get(timeout=10)
+            except queue.Empty:
+                for pid, (worker, device, _) in list(workers.items()):
+                    if worker.is_alive():
+                        continue
+                    del workers[pid]
+                    key = assigned.pop(pid, None)
+                    if key is not None:
+                        if handle(*key, None, f"worker {pid} exited with code {worker.exitcode}"):
+                            pending.append(tasks_by_key[key])
+                        else:
+                            remaining -= 1
+                    if remaining:
+                        start_worker(device)
+                dispatch()
+                continue
+            if assigned.pop(pid, None) is None:
+                # Late result of a worker already counted as dead.
+                continue
+            if handle(*result):
+                pending.append(tasks_by_key[result[:2]])
+            else:
+                remaining -= 1
+            dispatch()
+
+        for _, _, task_queue in workers.values():
+            task_queue.put(None)
+        for worker, _, _ in workers.values():
+            worker.join()
+
+    progress.close()
+    return results, failures
+
+
+def embed_sources(sources: list, batch_size: int = 32, index_type: str = "auto", storage: str = "float32",
+                  full: bool = False, num_workers: int = 1, devices: list = None, retries: int = 1):
+    """Embed the databases of several ``(input_file, embed_path)`` sources in one worker pool."""
+    options = {"batch_size": batch_size, "index_type": index_type, "storage": storage, "full": full}
+    documents_by_path = {}
+    tasks = []
+    for input_file, embed_path in sources:
+        os.makedirs(embed_path, exist_ok=True)
+        # Databases are read one shard at a time, so no process holds a whole documents file.
+        store = get_document_store(input_file)
+        documents_by_path[embed_path] = store.db_names()
+        tasks.extend((embed_path, db_name, store.shard_dir) for db_name in store.db_names())
+    # Largest databases first, so the longest builds do not start last.
+    tasks.sort(key=lambda task: get_document_store(task[2]).num_columns(task[1]), reverse=True)
+
+    start_time = time.time()
+    results, failures = _run_embed_tasks(tasks, options, num_workers, devices, retries)
+
+    for embed_path, db_names in documents_by_path.items():
+        db_stats = [results[(embed_path, db_name)] for db_name in db_names if (embed_path, db_name) in results]
+        summary = {key: sum(stats[key] for stats in db_stats)
+                   for key in ("columns", "encoded", "unique", "reused", "deleted", "rewritten", "index_bytes",
+                               "encode_seconds")}
+        removed = remove_stale_databases(embed_path, db_names)
+
+        print(f"{embed_path}: {summary['columns']} columns in {len(db_stats)} databases, "
+              f"{storage} indexes: {summary['index_bytes'] / 1024**2:.1f} MB")
+        print(f"Rewrote {summary['rewritten']}/{len(db_names)} databases, removed {len(removed)}; "
+              f"encoded {summary['encoded']} column documents, reused {summary['reused']} "
+              f"({summary['reused'] / max(1, summary['columns']):.1%} skipped), dropped {summary['deleted']}")
+        if summary["encoded"]:
+            print(f"Encoded {summary['unique']} unique of {summary['encoded']} documents: "
+                  f"{summary['encoded'] / max(summary['encode_seconds'], 1e-9):.1f} docs/s "
+                  f"({summary['unique'] / max(summary['encode_seconds'], 1e-9):.1f} unique/s)")
+
+    slowest = sorted(results.items(), key=lambda item: item[1]["seconds"], reverse=True)[:10]
+    print("Slowest databases: " + ", ".join(f"{db_name} {stats['seconds']:.1f}s" for (_, db_name), stats in slowest))
+    print(f"Embedded {len(results)}/{len(tasks)} databases in {time.time() - start_time:.1f}s")
+    if failures:
+        print(f"Failed databases: {', '.join(db_name for _, db_name in failures)}")
+    return results, failures
+
+
+def embed_documents(input_file: str, embed_path: str, batch_size: int = 32, index_type: str = "auto",
+                    storage: str = "float32", full: bool = False, num_workers: int = 1, devices: list = None,
+                    retries: int = 1):
+    return embed_sources([(input_file, embed_path)], batch_size=batch_size, index_type=index_type, storage=storage,
+                         full=full, num_workers=num_workers, devices=devices, retries=retries)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_type', type=str, default="auto", choices=INDEX_TYPES)
+    parser.add_argument('--storage', type=str, default="float32", choices=STORAGE_MODES)
+    parser.add_argument('--full', action="store_true", help="re-encode every column instead of reusing unchanged vectors")
+    parser.add_argument('--num_workers', type=int, default=1, help="worker processes; >1 builds databases in parallel")
+    parser.add_argument('--devices', type=str, nargs="+", default=None, help="e.g. cuda:0 cuda:1; default all GPUs or cpu")
+    parser.add_argument('--retries', type=int, default=1)
+    args = parser.parse_args()
+
+    sources = []
     for db in DBS_PATH:
         if "bigquery" in db:
-            print("Embedding BigQuery documents...")
-            embed_documents(os.path.join("documents", "bigquery.json"), "embeddings/bigquery", batch_size=1024)
+            sources.append((os.path.join("documents", "bigquery.json"), "embeddings/bigquery"))
         if "snowflake" in db:
-            print("Embedding Snowflake documents...")
-            embed_documents(os.path.join("documents", "snowflake.json"), "embeddings/snowflake", batch_size=1024)
+            sources.append((os.path.join("documents", "snowflake.json"), "embeddings/snowflake"))
         if "sqlite" in db:
-            print("Embedding SQLite documents...")
-            embed_documents(os.path.join("documents", "localdb.json"), "embeddings/localdb", batch_size=1024)
+            sources.append((os.path.join("documents", "localdb.json"), "embeddings/localdb"))
+
+    print(f"Embedding documents of {len(sources)} sources with {args.num_workers} worker(s)...")
+    embed_sources(sources, batch_size=1024, index_type=args.index_type, storage=args.storage, full=args.full,
+                  num_workers=args.num_workers, devices=args.devices, retries=args.retries)
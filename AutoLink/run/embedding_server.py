@@ -0,0 +1,292 @@
+import os
+import stat
+import time
+import tempfile
+import argparse
+import threading
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+
+
+EMBED_SERVER_ENV = "AUTOLINK_EMBED_SERVER"
+EMBED_AUTHKEY_ENV = "AUTOLINK_EMBED_AUTHKEY"
+SOCKET_NAME = "autolink_embed.sock"
+LATENCY_WINDOW = 1000
+
+
+def _private_dir() -> str:
+    """$XDG_RUNTIME_DIR, else a per-user 0700 directory under the temp dir."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return runtime_dir
+    path = os.path.join(tempfile.gettempdir(), f"autolink-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        # Squatted or loosened by someone else: use a fresh directory instead.
+        return tempfile.mkdtemp(prefix="autolink-")
+    return path
+
+
+def default_socket_path() -> str:
+    return os.path.join(_private_dir(), SOCKET_NAME)
+
+
+def _key_path(socket_path: str) -> str:
+    return socket_path + ".key"
+
+
+def _read_authkey(socket_path: str) -> bytes:
+    """AUTOLINK_EMBED_AUTHKEY, else the key file the server wrote next to the socket."""
+    if os.environ.get(EMBED_AUTHKEY_ENV):
+        return os.environ[EMBED_AUTHKEY_ENV].encode()
+    with open(_key_path(socket_path), "rb") as f:
+        return f.read()
+
+
+def _write_authkey(socket_path: str) -> bytes:
+    if os.environ.get(EMBED_AUTHKEY_ENV):
+        return os.environ[EMBED_AUTHKEY_ENV].encode()
+    authkey = os.urandom(32)
+    key_path = _key_path(socket_path)
+    tmp_path = f"{key_path}.{os.getpid()}.tmp"
+    if os.path.lexists(tmp_path):
+        os.unlink(tmp_path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    # Clients never see a partially written key.
+    os.replace(tmp_path, key_path)
+    return authkey
+
+
+def _remove_socket(socket_path: str):
+    """Remove a stale socket; refuse to delete anything else at that path."""
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode):
+        raise FileExistsError(f"{socket_path} exists and is not a socket")
+    os.unlink(socket_path)
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+    values = np.array(latencies) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+    }
+
+
+class EmbeddingServer:
+    """Owns the embedding model and serves encode requests over a Unix socket.
+
+    Each client connection gets a handler thread; concurrent requests from
+    all clients are merged into batched forward passes by the model manager's
+    EncodeBatcher. The queue depth is the number of requests in flight.
+    Connections must authenticate with the key from AUTOLINK_EMBED_AUTHKEY or,
+    if unset, a random key written to a 0600 ``<socket>.key`` file, since
+    requests are unpickled.
+    """
+
+    def __init__(self, socket_path: str = None, model_path: str = None, device: str = "cuda:0"):
+        self.socket_path = socket_path or default_socket_path()
+        self.model_path = model_path
+        self.device = device
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.listener = None
+        self.authkey = None
+        self.stopped = threading.Event()
+
+    def serve_forever(self):
+        from model_manager import model_manager
+        model_manager.load_model(self.model_path, device=self.device, use_server=False)
+
+        _remove_socket(self.socket_path)
+        self.authkey = _write_authkey(self.socket_path)
+        self.listener = Listener(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+        print(f"Embedding server {os.getpid()} listening on {self.socket_path}")
+
+        try:
+            while not self.stopped.is_set():
+                try:
+                    conn = self.listener.accept()
+                except (AuthenticationError, EOFError) as e:
+                    print(f"Rejected embedding client: {e}")
+                    continue
+                except OSError:
+                    break
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self.listener.close()
+            _remove_socket(self.socket_path)
+            if not os.environ.get(EMBED_AUTHKEY_ENV) and os.path.exists(_key_path(self.socket_path)):
+                os.unlink(_key_path(self.socket_path))
+            print(f"Embedding server stopped: {self.stats()}")
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = request.get("op")
+                if op == "encode":
+                    conn.send(self._encode(request["texts"], request.get("batch_size", 64)))
+                elif op == "info":
+                    conn.send(self.info())
+                elif op == "stats":
+                    conn.send(self.stats())
+                elif op == "shutdown":
+                    conn.send({"ok": True})
+                    self.stop()
+                    return
+                else:
+                    conn.send({"error": f"Unknown op: {op}"})
+
+    def _encode(self, texts: list, batch_size: int):
+        from model_manager import model_manager
+        with self.stats_lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        start = time.perf_counter()
+        response = {"embeddings": None, "error": None}
+        try:
+            response["embeddings"] = model_manager.encode_batch(texts, batch_size=batch_size)
+        except Exception as e:
+            response["error"] = str(e)
+        with self.stats_lock:
+            self.queue_depth -= 1
+            self.requests += 1
+            self.texts += len(texts)
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def stop(self):
+        self.stopped.set()
+        if self.listener is not None:
+            # Unblock accept() by connecting once.
+            try:
+                Client(self.socket_path, family="AF_UNIX", authkey=self.authkey).close()
+            except OSError:
+                pass
+
+    def info(self):
+        """The model behind this server; clients key their embedding caches on it."""
+        from model_manager import model_manager
+        return {"model_path": model_manager.model_path, "backend": model_manager.backend,
+                "device": model_manager.device}
+
+    def stats(self):
+        from model_manager import model_manager
+        with self.stats_lock:
+            return {
+                "requests": self.requests,
+                "texts": self.texts,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "encode": _latency_summary(self.latencies),
+                "batching": model_manager.get_batch_stats(),
+                "embedding_cache": model_manager.get_cache_stats(),
+            }
+
+
+class EmbeddingClient:
+    """Client side of EmbeddingServer; one connection per thread."""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=_read_authkey(self.socket_path))
+            self.local.conn = conn
+        return conn
+
+    def _call(self, request: dict):
+        conn = self._connection()
+        try:
+            conn.send(request)
+            return conn.recv()
+        except (EOFError, OSError):
+            self.local.conn = None
+            raise
+
+    def encode(self, texts: list, batch_size: int = 64) -> np.ndarray:
+        start = time.perf_counter()
+        response = self._call({"op": "encode", "texts": list(texts), "batch_size": batch_size})
+        if response.get("error"):
+            raise RuntimeError(f"Embedding server error: {response['error']}")
+        with self.stats_lock:
+            self.requests += 1
+            self.latencies.append(time.perf_counter() - start)
+        return response["embeddings"]
+
+    def server_info(self):
+        return self._call({"op": "info"})
+
+    def server_stats(self):
+        return self._call({"op": "stats"})
+
+    def stats(self):
+        with self.stats_lock:
+            summary = {"requests": self.requests, **_latency_summary(self.latencies)}
+        try:
+            summary["server"] = self.server_stats()
+        except (EOFError, OSError) as e:
+            summary["server"] = f"unavailable: {e}"
+        return summary
+
+    def shutdown(self):
+        return self._call({"op": "shutdown"})
+
+
+def wait_for_server(socket_path: str, timeout: float = 600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            Client(socket_path, family="AF_UNIX", authkey=_read_authkey(socket_path)).close()
+            return True
+        except (FileNotFoundError, ConnectionRefusedError, AuthenticationError):
+            # A restarting server may not have written its new key yet; the key
+            # file is read again on the next attempt.
+            time.sleep(0.5)
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', type=str, default=None, help="default: autolink_embed.sock in $XDG_RUNTIME_DIR "
+                        "or a private per-user temp directory")
+    parser.add_argument('--model_path', type=str, default=None)
+    parser.add_argument('--device', type=str, default="cuda:0")
+    parser.add_argument('--stats', action="store_true", help="print the stats of a running server and exit")
+    parser.add_argument('--shutdown', action="store_true", help="stop a running server and exit")
+    args = parser.parse_args()
+
+    if args.stats or args.shutdown:
+        client = EmbeddingClient(args.socket or default_socket_path())
+        print(client.server_stats() if args.stats else client.shutdown())
+    else:
+        os.environ.pop(EMBED_SERVER_ENV, None)
+        EmbeddingServer(args.socket, args.model_path, args.device).serve_forever()
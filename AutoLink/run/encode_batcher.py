@@ -0,0 +1,94 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+DEFAULT_WINDOW_MS = 2.0
+DEFAULT_MAX_BATCH = 64
+
+
+class EncodeBatcher:
+    """Merge concurrent encode requests into batched forward passes.
+
+    Callers submit lists of texts and block on their own result. A background
+    thread takes the first pending request, keeps collecting for up to
+    ``window_ms`` or until ``max_batch_size`` texts are queued, runs
+    ``encode_fn`` once over all of them and hands each caller its slice.
+    It stops waiting early once every blocked caller is in the batch, so a
+    lone caller pays no window latency.
+    """
+
+    def __init__(self, encode_fn, window_ms: float = None, max_batch_size: int = None):
+        if window_ms is None:
+            window_ms = float(os.environ.get("AUTOLINK_ENCODE_WINDOW_MS", DEFAULT_WINDOW_MS))
+        if max_batch_size is None:
+            max_batch_size = int(os.environ.get("AUTOLINK_ENCODE_MAX_BATCH", DEFAULT_MAX_BATCH))
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.waiting = 0
+        self.batches = 0
+        self.texts = 0
+        self.calls = 0
+
+    def submit(self, texts: list):
+        future = Future()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            self.waiting += 1
+        self.requests.put((list(texts), future))
+        try:
+            return future.result()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.window
+        while size < self.max_batch_size and len(batch) < self.waiting:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                embeddings = self.encode_fn(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self.lock:
+                self.batches += 1
+                self.texts += len(texts)
+                self.calls += len(batch)
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "calls": self.calls,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "pending": self.requests.qsize(),
+            }
@@ -2,6 +2,10 @@ import os
 import json
 from utils import *
 import time
+import argparse
+import multiprocessing as mp
+from tqdm import tqdm
+from document_store import DOCUMENT_INDEX_FILE, shard_dir_for, write_document_shard, write_document_index, remove_stale_shards
 
 BIGQUERY_PATH = "resource/databases/bigquery"
 SNOWFLAKE_PATH = "resource/databases/snowflake"
@@ -9,7 +13,145 @@ LOCALDB_PATH = "resource/databases/sqlite"
 
 DBS_PATH = [BIGQUERY_PATH, SNOWFLAKE_PATH, LOCALDB_PATH]
 
-def generate_documents(db: str, output_path: str = "documents"):
+def load_table(json_file: str):
+    with open(json_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    keys = list(data.keys())
+
+    table_name = data["table_fullname"]
+
+    if "nested_column_names" in keys:
+        column_names = data["column_names"]
+        column_types = data["column_types"]
+        nested_column_names = data["nested_column_names"]
+        if len(nested_column_names) <= len(column_names):
+            column_names = nested_column_names
+            column_types = data["nested_column_types"]
+            column_descriptions = data["description"]
+        else:
+            column_descriptions = []
+            for column_name in column_names:
+                for nested_column_name, column_description in zip(nested_column_names, data["description"]):
+                    if column_name == nested_column_name:
+                        column_descriptions.append(column_description)
+                        break
+    else:
+        column_names = data["column_names"]
+        column_types = data["column_types"]
+        column_descriptions = data["description"]
+
+    return table_name, column_names, column_types, column_descriptions, data["sample_rows"]
+
+
+def group_partitions(tables) -> dict:
+    """Fold date-sharded tables into the first table of their partition.
+
+    A table is a partition of an earlier one when both names are equal after
+    ``remove_digits`` and both have the same (non-empty) column set. Tables are
+    bucketed by that key, so each lookup is O(1) instead of a scan over every
+    processed table.
+    """
+    processed_tables = {}
+    buckets = {}
+
+    for table_name, column_names, column_types, column_descriptions, sample_rows in tables:
+        column_set = frozenset(column_names)
+        key = (remove_digits(table_name), column_set)
+
+        if column_set and key in buckets:
+            info = processed_tables[buckets[key]]
+            info["similar_tables"].append(table_name)
+            # Column sets are equal, so only types/descriptions shorter than the
+            # column list can gain entries (from the partition), as before.
+            for field, values in (("column_types", column_types), ("description", column_descriptions)):
+                if len(info[field]) < len(info["columns"]):
+                    existing = dict(zip(info["columns"], info[field]))
+                    current = dict(zip(column_names, values))
+                    info[field] = info[field] + [current.get(col, "") for col in info["columns"] if col not in existing]
+            continue
+
+        if table_name in processed_tables:
+            # A repeated table name replaces the earlier entry in place.
+            previous = processed_tables[table_name]
+            buckets.pop((remove_digits(table_name), frozenset(previous["columns"])), None)
+
+        processed_tables[table_name] = {
+            "columns": column_names,
+            "column_types": column_types,
+            "similar_tables": [],
+            "description": column_descriptions,
+            "sample_rows": sample_rows
+        }
+        if column_set:
+            buckets[key] = table_name
+
+    return processed_tables
+
+
+def generate_db_documents(subdir_path: str) -> dict:
+    json_files = get_json_files(subdir_path)
+
+    processed_tables = group_partitions(load_table(json_file) for json_file in json_files)
+
+    db_documents = {}
+
+    for table_name, table_info in processed_tables.items():
+        column_names = table_info["columns"]
+        similar_tables = table_info["similar_tables"]
+        description = table_info["description"]
+        column_types = table_info["column_types"]
+        sample_rows = table_info["sample_rows"]
+
+        db_documents[table_name] = {
+            "similar_tables": similar_tables,
+            "columns": {},
+            "column_types": column_types,
+            "sample_values": []
+        }
+        for column_name in column_names:
+            column_values = []
+            for sample_row in sample_rows:
+                column_values.append(str(sample_row.get(column_name, "")))
+            db_documents[table_name]["sample_values"].append(column_values)
+
+        for column_name, column_type, column_desc in zip(column_names, column_types, description):
+            column_desc = column_desc if column_desc is not None else ""
+            desc = (
+                    "column name: " + column_name + "\n" +
+                    "column type: " + column_type + "\n" +
+                    "table name: " + table_name + "\n" +
+                    "description: " + column_desc + "\n"
+            )
+            db_documents[table_name]["columns"][column_name] = desc
+
+    return db_documents
+
+
+def source_signature(subdir_path: str) -> dict:
+    """mtime and size of every table file of a database, keyed by relative path."""
+    signature = {}
+    for json_file in get_json_files(subdir_path):
+        stat = os.stat(json_file)
+        signature[os.path.relpath(json_file, subdir_path)] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+def _generate_shard(task):
+    subdir_path, shard_dir, subdir, signature = task
+    start_time = time.time()
+    entry = write_document_shard(shard_dir, subdir, generate_db_documents(subdir_path))
+    entry["sources"] = signature
+    return subdir, entry, time.time() - start_time
+
+
+def generate_documents(db: str, output_path: str = "documents", num_workers: int = 1, full: bool = False):
+    """Write one document shard per database under ``<output_path>/<source>/``.
+
+    The shard index doubles as a manifest of each database's table files
+    (mtime and size); databases whose files are unchanged keep their shard,
+    the others are regenerated in a pool of ``num_workers`` processes.
+    """
     if "bigquery" in db:
         output_file = "bigquery.json"
     elif "snowflake" in db:
@@ -19,148 +161,67 @@ def generate_documents(db: str, output_path: str = "documents"):
     else:
         raise ValueError("Invalid database path")
 
-    subdirs = get_subdir(db)
-    documents = {}
+    shard_dir = shard_dir_for(os.path.join(output_path, output_file))
+    os.makedirs(shard_dir, exist_ok=True)
+
+    previous = {}
+    index_path = os.path.join(shard_dir, DOCUMENT_INDEX_FILE)
+    if os.path.exists(index_path) and not full:
+        with open(index_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)["databases"]
 
+    subdirs = get_subdir(db)
+    databases = {}
+    tasks = []
     for subdir in subdirs:
-        documents[subdir] = {}
         subdir_path = os.path.join(db, subdir)
-        json_files = get_json_files(subdir_path)
-
-        processed_tables = {}
-
-        is_error = False
-
-        for json_file in json_files:
-
-            with open(json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            keys = list(data.keys())
-
-            table_name = data["table_fullname"]
-
-            if "nested_column_names" in keys:
-                column_names = data["column_names"]
-                column_types = data["column_types"]
-                nested_column_names = data["nested_column_names"]
-                if len(nested_column_names) <= len(column_names):
-                    column_names = nested_column_names
-                    column_types = data["nested_column_types"]
-                    column_descriptions = data["description"]
-                else:
-                    column_descriptions = []
-                    for column_name in column_names:
-                        for nested_column_name, column_description in zip(nested_column_names, data["description"]):
-                            if column_name == nested_column_name:
-                                column_descriptions.append(column_description)
-                                break
-            else:
-                column_names = data["column_names"]
-                column_types = data["column_types"]
-                column_descriptions = data["description"]
-                
-            current_column_set = set(column_names)
-            current_column_types_dict = dict(zip(column_names, column_types))
-            current_descriptions_dict = dict(zip(column_names, column_descriptions))
-
-            sample_rows = data["sample_rows"]
-
-            is_partition = False
-            for table, info in processed_tables.items():
-                table_name_similar = remove_digits(table_name) == remove_digits(table)
-                
-                if table_name_similar:
-                    existing_column_set = set(info["columns"])
-                    
-                    intersection = current_column_set & existing_column_set
-                    union = current_column_set | existing_column_set
-                    
-                    if len(union) > 0:
-                        similarity = len(intersection) / len(union)
-                        
-                        if similarity >= 1:
-                            info["similar_tables"].append(table_name)
-                            merged_columns = info["columns"].copy()
-                            for col in column_names:
-                                if col not in merged_columns:
-                                    merged_columns.append(col)
-                            
-                            merged_column_types = info["column_types"].copy()
-                            existing_types_dict = dict(zip(info["columns"], info["column_types"]))
-                            for col in merged_columns:
-                                if col not in existing_types_dict:
-                                    merged_column_types.append(current_column_types_dict.get(col, ""))
-                            
-                            merged_descriptions = info["description"].copy()
-                            existing_desc_dict = dict(zip(info["columns"], info["description"]))
-                            for col in merged_columns:
-                                if col not in existing_desc_dict:
-                                    merged_descriptions.append(current_descriptions_dict.get(col, ""))
-                            
-                            info["columns"] = merged_columns
-                            info["column_types"] = merged_column_types
-                            info["description"] = merged_descriptions
-                            
-                            is_partition = True
-                            break
-
-            if not is_partition:
-                processed_tables[table_name] = {
-                    "columns": column_names,
-                    "column_types": column_types,
-                    "similar_tables": [],
-                    "description": column_descriptions,
-                    "sample_rows": sample_rows
-                }
-
-        for table_name, table_info in processed_tables.items():
-            column_names = table_info["columns"]
-            similar_tables = table_info["similar_tables"]
-            description = table_info["description"]
-            column_types = table_info["column_types"]
-            sample_rows = table_info["sample_rows"]
-
-            documents[subdir][table_name] = {
-                "similar_tables": similar_tables,
-                "columns": {},
-                "column_types": column_types,
-                "sample_values": []
-            }
-            for column_name in column_names:
-                column_values = []
-                for sample_row in sample_rows:
-                    column_values.append(str(sample_row.get(column_name, "")))
-                documents[subdir][table_name]["sample_values"].append(column_values)
-
-            for column_name, column_type, column_desc in zip(column_names, column_types, description):
-                column_desc = column_desc if column_desc is not None else ""
-                desc = (
-                        "column name: " + column_name + "\n" +
-                        "column type: " + column_type + "\n" +
-                        "table name: " + table_name + "\n" +
-                        "description: " + column_desc + "\n"
-                )
-                documents[subdir][table_name]["columns"][column_name] = desc
-
-        if is_error:
-            print(f"{subdir} has error")
+        signature = source_signature(subdir_path)
+        entry = previous.get(subdir)
+        if entry is not None and entry.get("sources") == signature and os.path.exists(os.path.join(shard_dir, entry["file"])):
+            databases[subdir] = entry
+        else:
+            tasks.append((subdir_path, shard_dir, subdir, signature))
+
+    start_time = time.time()
+    timings = {}
+    if num_workers > 1 and len(tasks) > 1:
+        with mp.get_context("spawn").Pool(processes=min(num_workers, len(tasks))) as pool:
+            for subdir, entry, seconds in tqdm(pool.imap_unordered(_generate_shard, tasks), total=len(tasks)):
+                databases[subdir] = entry
+                timings[subdir] = seconds
+    else:
+        for task in tqdm(tasks):
+            subdir, entry, seconds = _generate_shard(task)
+            databases[subdir] = entry
+            timings[subdir] = seconds
 
-    os.makedirs(output_path, exist_ok=True)
+    # Keep the index in the order os.listdir returned the databases, as the monolithic file did.
+    write_document_index(shard_dir, {subdir: databases[subdir] for subdir in subdirs})
+    # Also covers --full, where the previous index is not read: any shard the
+    # new index does not list belongs to a database that no longer exists.
+    removed = remove_stale_shards(shard_dir, databases)
 
-    with open(os.path.join(output_path, output_file), "w", encoding="utf-8") as f:
-        json.dump(documents, f, indent=4, ensure_ascii=False)
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:5]
+    print(f"{shard_dir}: regenerated {len(tasks)}/{len(subdirs)} databases, reused {len(subdirs) - len(tasks)}, "
+          f"removed {len(removed)} in {time.time() - start_time:.1f}s")
+    if slowest:
+        print("Slowest databases: " + ", ".join(f"{subdir} {seconds:.1f}s" for subdir, seconds in slowest))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--full', action="store_true", help="regenerate every database instead of reusing unchanged shards")
+    args = parser.parse_args()
+
     print("Gnerate documents ...")
     for db in DBS_PATH:
         if "bigquery" in db:
             print("Processing BigQuery...")
-            generate_documents(db, output_path="documents")
+            generate_documents(db, output_path="documents", num_workers=args.num_workers, full=args.full)
         if "snowflake" in db:
             print("Processing Snowflake...")
-            generate_documents(db, output_path="documents")
+            generate_documents(db, output_path="documents", num_workers=args.num_workers, full=args.full)
         if "sqlite" in db:
             print("Processing SQLite...")
-            generate_documents(db, output_path="documents")
+            generate_documents(db, output_path="documents", num_workers=args.num_workers, full=args.full)
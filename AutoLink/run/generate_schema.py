@@ -1,8 +1,15 @@
 import os
 import json
+import time
 from tqdm import tqdm
 import re
 import argparse
+import multiprocessing as mp
+from functools import lru_cache
+from utils import determine_documents_path, read_external_knowledge
+from document_store import get_document_store
+from prompt_budget import (fit_user_input, tokenizer_name, token_budget, SCHEMA_LEVELS, DESCRIPTION_LIMIT,
+                           SIMILAR_TABLES_LIMIT, PROMPT_TOKENS_FILE)
 
 def extract_description(description_text):
     lines = description_text.strip().split("\n")
@@ -58,6 +65,70 @@ def truncate_nested_dict(obj, max_length=100):
             return str_obj[:max_length] + "...(truncated)"
         return str_obj
 
+def _truncated_str(value, max_length: int) -> str:
+    return str(value)[:max_length] + "...(truncated)" if len(str(value)) > max_length else str(value)
+
+
+def _render_dict_value(value, max_length: int, log_errors: bool = False) -> tuple:
+    dict_content = get_parentheses_content(value, "{", "}")
+
+    dict_content = preprocess_json_content(dict_content)
+
+    rendered = []
+    try:
+        dict_content = json.loads(dict_content)
+    except Exception as e:
+        try:
+            dict_content = fix_malformed_json(dict_content)
+            dict_content = json.loads(dict_content)
+        except Exception as e2:
+            if log_errors:
+                with open("error_log.txt", "a") as error_file:
+                    error_file.write(f"Error processing dict content: {dict_content[:500]}...\n")
+                    error_file.write(f"Error: {str(e2)}\n")
+                    print(f"Error processing dict content: {dict_content[:500]}...\n")
+            rendered.append(_truncated_str(value, max_length))
+
+    truncated_dict = truncate_nested_dict(dict_content, max_length=max_length)
+    rendered.append(json.dumps(truncated_dict, ensure_ascii=False))
+    return tuple(rendered)
+
+
+def _render_array_value(value, max_length: int) -> tuple:
+    array_content = "[" + get_parentheses_content(value, "{", "}") + "]"
+
+    if array_content != "[]":
+        array_content = preprocess_json_content(array_content)
+    else:
+        array_content = preprocess_json_content(value)
+
+    truncated_array = truncate_nested_dict(array_content, max_length=max_length)
+    return (json.dumps(truncated_array, ensure_ascii=False),)
+
+
+def _render_nested_value(value, kind: str, max_length: int) -> tuple:
+    if kind == "dict":
+        return _render_dict_value(value, max_length)
+    if kind == "variant_dict":
+        return _render_dict_value(value, max_length, log_errors=True)
+    return _render_array_value(value, max_length)
+
+
+# The same sample values show up for every instance that retrieves the column,
+# so renderings are memoized; a failed parse is therefore logged only once.
+# The cache is keyed on the raw value, so large JSON blobs bypass it to keep
+# its memory bounded (at most RENDER_CACHE_SIZE * RENDER_CACHE_MAX_CHARS).
+RENDER_CACHE_SIZE = 16384
+RENDER_CACHE_MAX_CHARS = 4096
+_render_nested_value_cached = lru_cache(maxsize=RENDER_CACHE_SIZE)(_render_nested_value)
+
+
+def render_nested_value(value, kind: str, max_length: int) -> tuple:
+    if isinstance(value, str) and len(value) <= RENDER_CACHE_MAX_CHARS:
+        return _render_nested_value_cached(value, kind, max_length)
+    return _render_nested_value(value, kind, max_length)
+
+
 def process_values(values: list, is_dict: bool = False, is_array: bool = False, is_variant: bool = False,
                    max_length: int = 100):
     if not (is_dict or is_array or is_variant):
@@ -69,35 +140,12 @@ def process_values(values: list, is_dict: bool = False, is_array: bool = False,
         if values[0] == "None":
             return values[:3]
         for i in range(3):
-            dict_content = get_parentheses_content(values[i], "{", "}")
-
-            dict_content = preprocess_json_content(dict_content)
-
-            try:
-                dict_content = json.loads(dict_content)
-            except Exception as e:
-                try:
-                    dict_content = fix_malformed_json(dict_content)
-                    dict_content = json.loads(dict_content)
-                except Exception as e2:
-                    final_values.append(str(values[i])[:max_length] + "...(truncated)" if len(str(values[i])) > max_length else str(
-                        values[i]))
-
-            truncated_dict = truncate_nested_dict(dict_content, max_length=max_length)
-            final_values.append(json.dumps(truncated_dict, ensure_ascii=False))
+            final_values.extend(render_nested_value(values[i], "dict", max_length))
         return final_values
 
     if is_array:
         for i in range(3):
-            array_content = "[" + get_parentheses_content(values[i], "{", "}") + "]"
-
-            if array_content != "[]":
-                array_content = preprocess_json_content(array_content)
-            else:
-                array_content = preprocess_json_content(values[i])
-
-            truncated_array = truncate_nested_dict(array_content, max_length=max_length)
-            final_values.append(json.dumps(truncated_array, ensure_ascii=False))
+            final_values.extend(render_nested_value(values[i], "array", max_length))
         return final_values
     
     if is_variant:
@@ -109,38 +157,12 @@ def process_values(values: list, is_dict: bool = False, is_array: bool = False,
             if values[0] == "None":
                 return values[:3]
             for i in range(3):
-                dict_content = get_parentheses_content(str(values[i]), "{", "}")
-
-                dict_content = preprocess_json_content(dict_content)
-                try:
-                    dict_content = json.loads(dict_content)
-                except Exception as e:
-                    try:
-                        dict_content = fix_malformed_json(dict_content)
-                        dict_content = json.loads(dict_content)
-                    except Exception as e2:
-                        with open("error_log.txt", "a") as error_file:
-                            error_file.write(f"Error processing dict content: {dict_content[:500]}...\n")
-                            error_file.write(f"Error: {str(e2)}\n")
-                            print(f"Error processing dict content: {dict_content[:500]}...\n")
-                            final_values.append(str(values[i])[:max_length] + "...(truncated)" if len(str(values[i])) > max_length else str(
-                            values[i]))
-
-                truncated_dict = truncate_nested_dict(dict_content, max_length=max_length)
-                final_values.append(json.dumps(truncated_dict, ensure_ascii=False))
+                final_values.extend(render_nested_value(str(values[i]), "variant_dict", max_length))
             return final_values
         
         elif values[0].startswith("["):
             for i in range(3):
-                array_content = "[" + get_parentheses_content(str(values[i]), "{", "}") + "]"
-
-                if array_content != "[]":
-                    array_content = preprocess_json_content(array_content)
-                else:
-                    array_content = preprocess_json_content(str(values[i]))
-
-                truncated_array = truncate_nested_dict(array_content, max_length=max_length)
-                final_values.append(json.dumps(truncated_array, ensure_ascii=False))
+                final_values.extend(render_nested_value(str(values[i]), "variant_array", max_length))
             return final_values
         else:
             if not long_value(values):
@@ -148,14 +170,34 @@ def process_values(values: list, is_dict: bool = False, is_array: bool = False,
             return [str(value)[:250] + "...(truncated)" if len(str(value)) > 250 else str(value) for value in values][:3]
 
 
+# preprocess_json_content is the identity on any text none of these match, so
+# such content skips the replacement and regex passes and is parsed directly.
+NEEDS_PREPROCESSING = re.compile(
+    r"[^\S ]|\s{2,}|array\(|\\\"|'|None|True|False"
+    r'|": "[^"]*"[^,}\]]*"|": \[\]"|"\d+\.?\d*[eE][+-]?\d+"|"null"|": "\d+\.?\d*"[,}\]]'
+)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+ARRAY_CALL_PATTERN = re.compile(r'array\([^)]*\)')
+QUOTED_STRING_PATTERN = re.compile(r'": "([^"]*)"([^,}\]]*)"')
+QUOTED_EMPTY_ARRAY_PATTERN = re.compile(r'": \[\]"')
+QUOTED_EXPONENT_PATTERN = re.compile(r'"(\d+\.?\d*[eE][+-]?\d+)"')
+QUOTED_NULL_PATTERN = re.compile(r'"null"')
+QUOTED_DECIMAL_PATTERN = re.compile(r'": "(\d+\.?\d*)"([,}\]])')
+QUOTED_INTEGER_PATTERN = re.compile(r'": "(\d+)"([,}\]])')
+TRAILING_STRING_PAIR_PATTERN = re.compile(r',\s*"[^"]*":\s*"[^"]*$')
+TRAILING_PAIR_PATTERN = re.compile(r',\s*"[^"]*":\s*[^,}]*$')
+TRAILING_COMMA_PATTERN = re.compile(r',(\s*[}\]])')
 
 
 def preprocess_json_content(content):
+    if not NEEDS_PREPROCESSING.search(content):
+        return content
+
     content = content.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
 
-    content = re.sub(r'\s+', ' ', content)
+    content = WHITESPACE_PATTERN.sub(' ', content)
 
-    content = re.sub(r'array\([^)]*\)', '[]', content)
+    content = ARRAY_CALL_PATTERN.sub('[]', content)
 
     content = content.replace('\\"', '"').replace("'", '"').replace("None", "null").replace("True", "true").replace("False", "false")
 
@@ -165,12 +207,12 @@ def preprocess_json_content(content):
 
 
 def fix_common_json_issues(content):
-    content = re.sub(r'": "([^"]*)"([^,}\]]*)"', r'": "\1\2"', content)
-    content = re.sub(r'": \[\]"', r'": []', content)
-    content = re.sub(r'"(\d+\.?\d*[eE][+-]?\d+)"', r'\1', content)
-    content = re.sub(r'"null"', 'null', content)
-    content = re.sub(r'": "(\d+\.?\d*)"([,}\]])', r'": \1\2', content)
-    content = re.sub(r'": "(\d+)"([,}\]])', r'": \1\2', content)
+    content = QUOTED_STRING_PATTERN.sub(r'": "\1\2"', content)
+    content = QUOTED_EMPTY_ARRAY_PATTERN.sub(r'": []', content)
+    content = QUOTED_EXPONENT_PATTERN.sub(r'\1', content)
+    content = QUOTED_NULL_PATTERN.sub('null', content)
+    content = QUOTED_DECIMAL_PATTERN.sub(r'": \1\2', content)
+    content = QUOTED_INTEGER_PATTERN.sub(r'": \1\2', content)
     return content
 
 
@@ -181,8 +223,8 @@ def fix_malformed_json(content):
         if last_comma > 0:
             content = content[:last_comma]
         content += "}"
-    content = re.sub(r',\s*"[^"]*":\s*"[^"]*$', '', content)
-    content = re.sub(r',\s*"[^"]*":\s*[^,}]*$', '', content)
+    content = TRAILING_STRING_PAIR_PATTERN.sub('', content)
+    content = TRAILING_PAIR_PATTERN.sub('', content)
 
     if content.count('{') > content.count('}'):
         content += '}' * (content.count('{') - content.count('}'))
@@ -190,7 +232,7 @@ def fix_malformed_json(content):
     if content.count('[') > content.count(']'):
         content += ']' * (content.count('[') - content.count(']'))
 
-    content = re.sub(r',(\s*[}\]])', r'\1', content)
+    content = TRAILING_COMMA_PATTERN.sub(r'\1', content)
 
     return content
 
@@ -253,119 +295,238 @@ def get_column_type(column_type: str):
     return is_dict, is_array, is_variant
 
 
-def generate_initial_schema_prompt(log_path: str):
-    with open(f"{log_path}/unfilled_pre_rule.json", "r", encoding="utf-8") as f:
-        initial_candidates = json.load(f)
+def _instance_kind(instance_id: str) -> str:
+    if instance_id.startswith("bq") or instance_id.startswith("ga"):
+        return "bq"
+    if instance_id.startswith("sf"):
+        return "sf"
+    return "other"
+
+
+def _values_key(values):
+    key = (type(values).__name__, tuple(values) if isinstance(values, list) else values)
+    try:
+        hash(key)
+    except TypeError:
+        key = ("json", json.dumps(values, sort_keys=True, default=str))
+    return key
+
+
+def render_column_line(instance_kind: str, column_name, column_type, column_value, description,
+                       with_values: bool = True, description_limit: int = None) -> str:
+    desc = extract_description(description)
+    if description_limit is not None and len(desc) > description_limit:
+        desc = desc[:description_limit] + "...(truncated)"
+    if not with_values:
+        if desc:
+            return f"    {column_name} (Type: {column_type}; Description: {desc})\n"
+        return f"    {column_name} (Type: {column_type})\n"
+    is_dict, is_array, is_variant = get_column_type(column_type)
+    if instance_kind != "sf":
+        column_va = process_values(column_value, is_dict=is_dict, is_array=is_array, is_variant=is_variant,
+                                   max_length=100)
+    else:
+        column_va = []
+        if column_value == []:
+            column_va = []
+        else:
+            for i in range(len(column_value)):
+                if len(str(column_value[i])) > 1000:
+                    column_va.append(column_value[i][:1000] + "...(truncated)")
+                else:
+                    column_va.append(column_value[i])
+            column_va = column_va[:3]
+    if desc:
+        return f"    {column_name} (Type: {column_type}; Sample values: {column_va}; Description: {desc})\n"
+    return f"    {column_name} (Type: {column_type}; Sample values: {column_va})\n"
+
+
+def render_table_footer(instance_kind: str, similar_tables: list, similar_tables_limit: int = None) -> str:
+    footer = "]\n"
+    if similar_tables:
+        if instance_kind == "bq":
+            table_name = [similar_table.split(".")[-1] for similar_table in similar_tables]
+        elif instance_kind == "sf":
+            table_name = [".".join(similar_table.split(".")[1:]) for similar_table in similar_tables]
+        else:
+            table_name = similar_tables
+        if similar_tables_limit is not None and len(table_name) > similar_tables_limit:
+            table_name = table_name[:similar_tables_limit] + [f"... ({len(table_name) - similar_tables_limit} more)"]
+        footer += f"**Some other tables have the similar structure: [{', '.join(table_name)}]**\n"
+    return footer + "\n" + "-" * 50 + "\n\n"
+
+
+class SchemaFragments:
+    """Rendered prompt fragments of one database.
+
+    Column lines and table headers/footers (with the similar-tables note)
+    are rendered the first time an instance asks for them and reused by
+    every other instance on the same database, so assembling a prompt is
+    a join over cached strings. ``level`` indexes SCHEMA_LEVELS; each level
+    adds one reduction to the ones before it.
+    """
+
+    def __init__(self, db_data: dict):
+        self.db_data = db_data
+        self.column_lines = {}
+        self.table_headers = {}
+        self.table_footers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def column_line(self, instance_kind: str, table, column_name, column_type, column_value, description,
+                    level: int = 0) -> str:
+        with_values, description_limit = level < 1, DESCRIPTION_LIMIT if level >= 2 else None
+        key = (instance_kind, table, column_name, column_type, description,
+               _values_key(column_value) if with_values else None, description_limit)
+        line = self.column_lines.get(key)
+        if line is None:
+            self.misses += 1
+            line = render_column_line(instance_kind, column_name, column_type, column_value, description,
+                                      with_values=with_values, description_limit=description_limit)
+            self.column_lines[key] = line
+        else:
+            self.hits += 1
+        return line
 
-    os.makedirs(f"{log_path}/schema_prompts", exist_ok=True)
+    def table_header(self, table) -> str:
+        if table not in self.table_headers:
+            self.table_headers[table] = f"###Table full name: {table}\n[\n"
+        return self.table_headers[table]
 
-    with open("documents/bigquery.json", "r", encoding="utf-8") as f:
-        bigquery_data = json.load(f)
+    def table_footer(self, instance_kind: str, table, level: int = 0) -> str:
+        similar_tables_limit = SIMILAR_TABLES_LIMIT if level >= 3 else None
+        key = (instance_kind, table, similar_tables_limit)
+        if key not in self.table_footers:
+            self.table_footers[key] = render_table_footer(instance_kind, self.db_data[table]["similar_tables"],
+                                                          similar_tables_limit)
+        return self.table_footers[key]
 
-    with open("documents/snowflake.json", "r", encoding="utf-8") as f:
-        snowflake_data = json.load(f)
+    def render(self, instance_id: str, schema_info: dict, level: int = 0) -> str:
+        instance_kind = _instance_kind(instance_id)
 
-    with open("documents/localdb.json", "r", encoding="utf-8") as f:
-        localdb_data = json.load(f)
+        mapping = {}
+        for column_name, column_type, column_value, table_name, description in zip(
+                schema_info["column_candidates"], schema_info["column_types"], schema_info["column_values"],
+                schema_info["table_candidates"], schema_info["descriptions"]
+        ):
+            mapping.setdefault(table_name, []).append(
+                self.column_line(instance_kind, table_name, column_name, column_type, column_value, description, level))
+
+        parts = []
+        for table, column_lines in mapping.items():
+            # Looked up before the columns are joined, as in the per-instance renderer.
+            footer = self.table_footer(instance_kind, table, level)
+            parts.append(self.table_header(table))
+            parts.extend(column_lines)
+            parts.append(footer)
+        return "".join(parts)
+
+
+def _generate_db_prompts(task):
+    log_path, documents_path, db_name, instances, budget = task
+    start_time = time.time()
+    db_data = get_document_store(documents_path).load(db_name)
+    fragments = SchemaFragments(db_data)
+    all_tables = list(db_data.keys())
+    usages = {}
+    for instance_id, schema_info, knowledge_name in instances:
+        # Fit against the same user message complete_schema will send.
+        schema_prompt, _, usages[instance_id] = fit_user_input(
+            lambda level: fragments.render(instance_id, schema_info, level),
+            question=schema_info["question"],
+            knowledge=read_external_knowledge(instance_id, knowledge_name),
+            all_tables=all_tables,
+            budget=budget,
+        )
+        with open(f"{log_path}/schema_prompts/{instance_id}.txt", "w", encoding="utf-8") as f:
+            f.write(schema_prompt)
+    return db_name, usages, fragments.hits, fragments.misses, time.time() - start_time
 
-    schema_prompt = ""
 
-    for instance_id, schema_info in tqdm(initial_candidates.items()):
-        db_name = schema_info["db_name"]
+def generate_initial_schema_prompt(log_path: str, num_workers: int = 1, budget: int = None):
+    """Write ``schema_prompts/<instance_id>.txt`` for every instance.
 
-        if instance_id.startswith("bq") or instance_id.startswith("ga"):
-            db_data = bigquery_data[db_name]
-        elif instance_id.startswith("sf"):
-            db_data = snowflake_data[db_name]
-        elif instance_id.startswith("local"):
-            db_data = localdb_data[db_name]
-        else:
-            raise ValueError(f"Unknown instance ID: {instance_id}")
+    Instances are grouped by database; each group shares one SchemaFragments
+    cache and groups are rendered in a pool of ``num_workers`` processes.
+    Each schema is reduced as far as needed for the user message to fit in
+    ``budget`` tokens (see prompt_budget.fit_user_input), and the tokens per
+    section are written to ``<log_path>/prompt_tokens.json``.
+    """
+    if budget is None:
+        budget = token_budget()
 
-        column_candidates = schema_info["column_candidates"]
-        column_types = schema_info["column_types"]
-        column_values = schema_info["column_values"]
-        column_candidates = schema_info["column_candidates"]
-        table_candidates = schema_info["table_candidates"]
-        descriptions = schema_info["descriptions"]
+    with open(f"{log_path}/unfilled_pre_rule.json", "r", encoding="utf-8") as f:
+        initial_candidates = json.load(f)
 
-        mapping = {}
+    spider2_data = {}
+    if os.path.exists("spider2_data.json"):
+        with open("spider2_data.json", "r", encoding="utf-8") as f:
+            spider2_data = json.load(f)
 
-        for column_name, column_type, column_value, table_name, description in zip(
-                column_candidates, column_types, column_values, table_candidates, descriptions
-        ):
-            if table_name not in mapping:
-                mapping[table_name] = {}
-                mapping[table_name]["columns"] = []
-                mapping[table_name]["column_types"] = []
-                mapping[table_name]["column_values"] = []
-                mapping[table_name]["descriptions"] = []
-
-            desc = extract_description(description)
-            mapping[table_name]["columns"].append(column_name)
-            mapping[table_name]["column_types"].append(column_type)
-            mapping[table_name]["column_values"].append(column_value)
-            mapping[table_name]["descriptions"].append(desc)
-
-        schema_prompt = ""
-        for table, column_info in mapping.items():
-
-            schema_prompt += f"###Table full name: {table}\n[\n"
-
-            columns = column_info["columns"]
-            column_types = column_info["column_types"]
-            column_values = column_info["column_values"]
-            descriptions = column_info["descriptions"]
-            similar_tables = db_data[table]["similar_tables"]
-
-            for column_name, column_type, column_value, description in zip(
-                    columns, column_types, column_values, descriptions
-            ):
-                is_dict, is_array, is_variant = get_column_type(column_type)
-                if not instance_id.startswith("sf"):
-                    column_va = process_values(column_value, is_dict=is_dict, is_array=is_array, is_variant=is_variant,
-                                              max_length=100)
-                else:
-                    column_va = []
-                    if column_value == []:
-                        column_va = []
-                    else:
-                        for i in range(len(column_value)):
-                            if len(str(column_value[i])) > 1000:
-                                column_va.append(column_value[i][:1000] + "...(truncated)")
-                            else:
-                                column_va.append(column_value[i])
-                        column_va = column_va[:3]
-                if description:
-                    schema_prompt += f"    {column_name} (Type: {column_type}; Sample values: {column_va}; Description: {description})\n"
-                else:
-                    schema_prompt += f"    {column_name} (Type: {column_type}; Sample values: {column_va})\n"
-            schema_prompt += "]\n"
-
-            if similar_tables:
-                if instance_id.startswith("bq") or instance_id.startswith("ga"):
-                    table_name = [similar_table.split(".")[-1] for similar_table in similar_tables]
-                    schema_prompt += f"**Some other tables have the similar structure: [{', '.join(table_name)}]**\n"
-                elif instance_id.startswith("sf"):
-                    try:
-                        table_name = [".".join(similar_table.split(".")[1:]) for similar_table in similar_tables]
-                        schema_prompt += f"**Some other tables have the similar structure: [{', '.join(table_name)}]**\n"
-                    except Exception as e:
-                        raise e
-                else:
-                    schema_prompt += f"**Some other tables have the similar structure: [{', '.join(similar_tables)}]**\n"
+    os.makedirs(f"{log_path}/schema_prompts", exist_ok=True)
 
-            schema_prompt += "\n" + "-" * 50 + "\n\n"
+    groups = {}
+    for instance_id, schema_info in initial_candidates.items():
+        key = (determine_documents_path(instance_id), schema_info["db_name"])
+        knowledge_name = spider2_data.get(instance_id, {}).get("external_knowledge", None)
+        groups.setdefault(key, []).append((instance_id, schema_info, knowledge_name))
+    # Open (and if needed rebuild) the shards once before workers are started.
+    for documents_path in {documents_path for documents_path, _ in groups}:
+        get_document_store(documents_path)
+
+    # Largest groups first so they do not end up as the tail of the pool.
+    tasks = [(log_path, documents_path, db_name, instances, budget)
+             for (documents_path, db_name), instances in sorted(groups.items(), key=lambda item: -len(item[1]))]
+
+    start_time = time.time()
+    hits = misses = 0
+    usages = {}
+    with tqdm(total=len(initial_candidates)) as progress:
+        if num_workers > 1 and len(tasks) > 1:
+            with mp.get_context("spawn").Pool(processes=min(num_workers, len(tasks))) as pool:
+                results = pool.imap_unordered(_generate_db_prompts, tasks)
+                for db_name, db_usages, db_hits, db_misses, seconds in results:
+                    hits, misses = hits + db_hits, misses + db_misses
+                    usages.update(db_usages)
+                    progress.update(len(db_usages))
+        else:
+            for task in tasks:
+                db_name, db_usages, db_hits, db_misses, seconds = _generate_db_prompts(task)
+                hits, misses = hits + db_hits, misses + db_misses
+                usages.update(db_usages)
+                progress.update(len(db_usages))
+
+    with open(os.path.join(log_path, PROMPT_TOKENS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"tokenizer": tokenizer_name(), "budget": budget,
+                   "instances": {instance_id: usages[instance_id] for instance_id in initial_candidates}},
+                  f, ensure_ascii=False, indent=2)
+
+    total = hits + misses
+    print(f"Rendered {len(initial_candidates)} prompts over {len(tasks)} databases in {time.time() - start_time:.1f}s, "
+          f"column lines rendered {misses}, reused {hits} ({hits / total if total else 0.0:.1%})")
+    levels = {level: 0 for level in SCHEMA_LEVELS}
+    for usage in usages.values():
+        levels[usage["schema_level"]] += 1
+    totals = sorted(usage["total"] for usage in usages.values())
+    if totals:
+        print(f"User input tokens ({tokenizer_name()}, budget {budget or 'off'}): "
+              f"median {totals[len(totals) // 2]}, max {totals[-1]}; schema levels {levels}; "
+              f"tables trimmed {sum(1 for usage in usages.values() if usage['tables_dropped'])}, "
+              f"knowledge truncated {sum(1 for usage in usages.values() if usage['knowledge_truncated'])}, "
+              f"over budget {sum(1 for usage in usages.values() if usage['over_budget'])}")
 
-        with open(f"{log_path}/schema_prompts/{instance_id}.txt", "w", encoding="utf-8") as f:
-            f.write(schema_prompt)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--log_path', type=str, default="log_v3_topn100")
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--token_budget', type=int, default=None,
+                        help="token budget of the initial user message, e.g. 32000 "
+                             "(default AUTOLINK_PROMPT_TOKEN_BUDGET, else 0: off)")
     args = parser.parse_args()
 
-    generate_initial_schema_prompt(args.log_path)
+    generate_initial_schema_prompt(args.log_path, num_workers=args.num_workers, budget=args.token_budget)
 
     all_prompts = os.listdir(f"{args.log_path}/schema_prompts")
     print("Schema prompts generated successfully.")
@@ -0,0 +1,92 @@
+import zlib
+import struct
+import numpy as np
+
+
+class IndexBitmap:
+    """Compact set of column indices of one database, one bit per column.
+
+    Membership and exclusion masks over candidate ids are vectorized, and the
+    bitmap serializes to zlib-compressed packed bits.
+    """
+
+    HEADER = struct.Struct("<Q")
+    # Set bits per byte value, for counting without unpacking.
+    POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+    def __init__(self, size: int = 0):
+        # Little-endian packed bits, the layout FAISS IDSelectorBitmap and
+        # to_bytes use, so neither needs to re-pack.
+        self.size = size
+        self.data = np.zeros((size + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def from_indices(cls, indices, size: int = 0):
+        bitmap = cls(size)
+        bitmap.add_many(indices)
+        return bitmap
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        raw = zlib.decompress(data)
+        size, = cls.HEADER.unpack_from(raw, 0)
+        bitmap = cls()
+        bitmap.size = size
+        bitmap.data = np.frombuffer(raw, dtype=np.uint8, offset=cls.HEADER.size).copy()
+        return bitmap
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(self.HEADER.pack(self.size) + self.data.tobytes())
+
+    def resize(self, size: int):
+        if size > self.size:
+            num_bytes = (size + 7) // 8
+            if num_bytes > len(self.data):
+                self.data = np.concatenate([self.data, np.zeros(num_bytes - len(self.data), dtype=np.uint8)])
+            self.size = size
+
+    def add(self, idx: int):
+        self.add_many([idx])
+
+    def add_many(self, indices):
+        indices = np.asarray(list(indices) if not isinstance(indices, np.ndarray) else indices, dtype=np.int64)
+        if len(indices) == 0:
+            return
+        self.resize(int(indices.max()) + 1)
+        np.bitwise_or.at(self.data, indices >> 3, np.left_shift(1, indices & 7).astype(np.uint8))
+
+    def mask(self, candidate_ids) -> np.ndarray:
+        """Boolean array, True where a candidate id is in the bitmap."""
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        in_range = (candidate_ids >= 0) & (candidate_ids < self.size)
+        ids = candidate_ids[in_range]
+        result = np.zeros(len(candidate_ids), dtype=bool)
+        result[in_range] = (self.data[ids >> 3] >> (ids & 7)) & 1
+        return result
+
+    def packed(self, size: int) -> np.ndarray:
+        """Little-endian packed bits padded to ``size`` ids, as FAISS IDSelectorBitmap expects."""
+        num_bytes = (size + 7) // 8
+        if num_bytes > len(self.data):
+            return np.concatenate([self.data, np.zeros(num_bytes - len(self.data), dtype=np.uint8)])
+        packed = self.data[:num_bytes]
+        if size < self.size and size % 8:
+            # Ids past ``size`` share the last byte; clear them in a copy.
+            packed = packed.copy()
+            packed[-1] &= (1 << (size % 8)) - 1
+        return packed
+
+    def count(self) -> int:
+        return int(self.POPCOUNT[self.data].sum())
+
+    def tolist(self) -> list:
+        return np.flatnonzero(np.unpackbits(self.data, count=self.size, bitorder="little")).tolist()
+
+    def __len__(self):
+        return self.count()
+
+    def __contains__(self, idx):
+        return 0 <= idx < self.size and bool((self.data[idx >> 3] >> (idx & 7)) & 1)
+
+    def __iter__(self):
+        return iter(self.tolist())
@@ -0,0 +1,175 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+import faiss
+from metadata_store import METADATA_BIN_FILE, MetadataStore, open_metadata_store
+
+
+DEFAULT_CACHE_MB = 2048
+INDEX_PARAMS_FILE = "index_params.json"
+
+
+class IndexCache:
+    """Process-resident LRU cache of per-database FAISS indexes and metadata.
+
+    Entries are keyed by ``(embed_path, db_name)`` and are reloaded when
+    ``index.faiss`` or ``metadata.json`` change on disk. The memory budget is
+    approximated by the on-disk size of both files. Unless AUTOLINK_INDEX_MMAP=0,
+    indexes and metadata.bin are memory-mapped so workers share one copy.
+    """
+
+    def __init__(self, max_bytes: int = None, use_mmap: bool = None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("AUTOLINK_INDEX_CACHE_MB", DEFAULT_CACHE_MB)) * 1024**2
+        if use_mmap is None:
+            use_mmap = os.environ.get("AUTOLINK_INDEX_MMAP", "1") != "0"
+        self.max_bytes = max_bytes
+        self.use_mmap = use_mmap
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def configure(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, embed_path: str, db_name: str):
+        entry = self._get_entry(embed_path, db_name)
+        return entry["index"], entry["metadata"]
+
+    def get_with_params(self, embed_path: str, db_name: str):
+        """``get`` plus the index's search params, from the same cache lookup."""
+        entry = self._get_entry(embed_path, db_name)
+        return entry["index"], entry["metadata"], entry["params"]
+
+    def _get_entry(self, embed_path: str, db_name: str):
+        key = (os.path.abspath(embed_path), db_name)
+        index_path = os.path.join(embed_path, db_name, "index.faiss")
+        metadata_path = os.path.join(embed_path, db_name, "metadata.json")
+        params_path = os.path.join(embed_path, db_name, INDEX_PARAMS_FILE)
+        params_signature = _file_signature(params_path) if os.path.exists(params_path) else None
+        signature = (_file_signature(index_path), _file_signature(metadata_path), params_signature)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["signature"] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+
+            self.misses += 1
+            if self.use_mmap:
+                index = read_index_mmap(index_path)
+                metadata_mapping = open_metadata_store(os.path.join(embed_path, db_name))
+            else:
+                index = faiss.read_index(index_path)
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    metadata_mapping = json.load(f)
+            params = {"index_type": "flat"}
+            if params_signature is not None:
+                with open(params_path, "r", encoding="utf-8") as f:
+                    params = json.load(f)
+            apply_search_params(index, params)
+
+            entry = {
+                "index": index,
+                "metadata": metadata_mapping,
+                "params": params,
+                "signature": signature,
+                "derived": {},
+                "size": signature[0][1] + signature[1][1],
+            }
+            self.entries[key] = entry
+            self.current_bytes += entry["size"]
+            self._evict()
+            return entry
+
+    def get_derived(self, embed_path: str, db_name: str, name: str, builder):
+        """Return ``builder(metadata)`` computed once per loaded database."""
+        entry = self._get_entry(embed_path, db_name)
+        with self.lock:
+            derived = entry["derived"]
+            if name not in derived:
+                derived[name] = builder(entry["metadata"])
+            return derived[name]
+
+    def invalidate(self, embed_path: str = None, db_name: str = None):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if embed_path is not None and key[0] != os.path.abspath(embed_path):
+                    continue
+                if db_name is not None and key[1] != db_name:
+                    continue
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+                "cached_mb": self.current_bytes / 1024**2,
+                "max_mb": self.max_bytes / 1024**2,
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.current_bytes -= entry["size"]
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget.
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+def database_size(embed_path: str, db_name: str) -> int:
+    """Column count of a database, read without loading its index or metadata."""
+    db_dir = os.path.join(embed_path, db_name)
+    bin_path = os.path.join(db_dir, METADATA_BIN_FILE)
+    if os.path.exists(bin_path):
+        return len(MetadataStore(bin_path))
+    params_path = os.path.join(db_dir, INDEX_PARAMS_FILE)
+    if os.path.exists(params_path):
+        with open(params_path, "r", encoding="utf-8") as f:
+            return json.load(f)["ntotal"]
+    index_path = os.path.join(db_dir, "index.faiss")
+    if os.path.exists(index_path):
+        return read_index_mmap(index_path).ntotal
+    return 0
+
+
+def read_index_mmap(index_path: str):
+    # Flat, scalar-quantized and HNSW storage is mapped read-only so that every
+    # worker on the host shares the page cache; other layouts are read privately.
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+
+def apply_search_params(index, params: dict):
+    parameter_space = faiss.ParameterSpace()
+    for name in ("nprobe", "efSearch"):
+        if name in params:
+            parameter_space.set_index_parameter(index, name, params[name])
+
+
+def _file_signature(path: str):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+index_cache = IndexCache()
@@ -7,6 +7,24 @@ export OPENAI_BASE_URL=""
 LOG_PATH=log_v3_topn100
 TOP_N=100
 
+# Optional: serve the embedding model from one process shared by all workers.
+# Clients authenticate with the 0600 key file the server writes next to the socket.
+# export AUTOLINK_EMBED_SERVER=$(python -c "from embedding_server import default_socket_path; print(default_socket_path())")
+# python embedding_server.py --socket "$AUTOLINK_EMBED_SERVER" --device cuda:0 &
+
+# Optional on GPU-less hosts: quantized CPU encoder (int8 or onnx) and its thread count.
+# export AUTOLINK_EMBED_BACKEND=int8
+# export AUTOLINK_EMBED_THREADS=16
+
+# Optional: token budget of the initial schema-linking message (off by default); counted with tiktoken if installed.
+# Over budget, sample values are dropped, descriptions shortened, then ALL_TABLES and external knowledge trimmed.
+# export AUTOLINK_PROMPT_TOKEN_BUDGET=32000
+
+# complete_schema runs conversations on an asyncio engine; tune in-flight conversations and LLM
+# requests (--engine process restores the worker-process engine).
+# export AUTOLINK_MAX_INSTANCES=256
+# export AUTOLINK_LLM_CONCURRENCY=64
+
 python generate_docs.py
 python embedding_docs.py
 
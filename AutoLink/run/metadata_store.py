@@ -0,0 +1,78 @@
+import os
+import json
+import mmap
+import struct
+import numpy as np
+
+
+METADATA_BIN_FILE = "metadata.bin"
+MAGIC = b"ALMD"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+
+
+def write_metadata_store(path: str, metadata_mapping: list):
+    """Write metadata as ``header | uint64 offsets[n + 1] | utf-8 JSON blob``.
+
+    The file is written to a temporary name and renamed, so concurrent readers
+    never see a partial file.
+    """
+    records = [json.dumps(metadata, ensure_ascii=False).encode("utf-8") for metadata in metadata_mapping]
+    offsets = np.zeros(len(records) + 1, dtype="<u8")
+    np.cumsum([len(record) for record in records], out=offsets[1:])
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        f.write(offsets.tobytes())
+        for record in records:
+            f.write(record)
+    os.replace(tmp_path, path)
+
+
+class MetadataStore:
+    """Read-only, memory-mapped view of a metadata.bin file.
+
+    Behaves like the list loaded from metadata.json; records are decoded on
+    access, and all processes mapping the same file share one page-cache copy.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported metadata store: {path}")
+        self.count = count
+        self.offsets = np.frombuffer(self.buffer, dtype="<u8", count=count + 1, offset=HEADER.size)
+        self.blob_start = HEADER.size + self.offsets.nbytes
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.count))]
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError("metadata index out of range")
+        start = self.blob_start + int(self.offsets[idx])
+        end = self.blob_start + int(self.offsets[idx + 1])
+        return json.loads(self.buffer[start:end].decode("utf-8"))
+
+    def __iter__(self):
+        for idx in range(self.count):
+            yield self[idx]
+
+
+def open_metadata_store(db_dir: str) -> MetadataStore:
+    """Open ``metadata.bin``, converting ``metadata.json`` first if it is missing or stale."""
+    json_path = os.path.join(db_dir, "metadata.json")
+    bin_path = os.path.join(db_dir, METADATA_BIN_FILE)
+    if not os.path.exists(bin_path) or (
+            os.path.exists(json_path) and os.path.getmtime(json_path) > os.path.getmtime(bin_path)):
+        with open(json_path, "r", encoding="utf-8") as f:
+            write_metadata_store(bin_path, json.load(f))
+    return MetadataStore(bin_path)
@@ -2,6 +2,41 @@ import threading
 import os
 from sentence_transformers import SentenceTransformer
 import torch
+import numpy as np
+from embedding_cache import EmbeddingCache
+from encode_batcher import EncodeBatcher
+from embedding_server import EMBED_SERVER_ENV, EmbeddingClient, wait_for_server
+
+BACKENDS = ["torch", "int8", "onnx"]
+
+
+def load_sentence_transformer(model_path: str, device: str, backend: str = "torch", num_threads: int = None):
+    """Load a SentenceTransformer with the given backend.
+
+    ``int8`` applies PyTorch dynamic quantization to the Linear layers and
+    ``onnx`` uses the ONNX Runtime export; both run on CPU only. ``num_threads``
+    sets torch's intra-op threads, and for ``onnx`` the ONNX Runtime session's.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}, choose from {BACKENDS}")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if backend == "torch":
+        return SentenceTransformer(model_path, device=device)
+    if device != "cpu":
+        raise ValueError(f"The {backend} backend only runs on CPU, got device {device}")
+    if backend == "onnx":
+        model_kwargs = {}
+        if num_threads:
+            # ONNX Runtime ignores torch.set_num_threads; it takes its own session options.
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = num_threads
+            model_kwargs["session_options"] = session_options
+        return SentenceTransformer(model_path, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    model = SentenceTransformer(model_path, device="cpu")
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
 
 class ModelManager:    
     _instance = None
@@ -18,22 +53,44 @@ class ModelManager:
         if not hasattr(self, 'initialized'):
             self.model = None
             self.device = None
+            self.model_path = None
+            self.backend = None
+            self.client = None
+            self.embedding_cache = EmbeddingCache()
             self.model_lock = threading.Lock()
+            self.batcher = EncodeBatcher(self._encode_texts)
             self.initialized = True
     
-    def load_model(self, model_path: str = None, device: str = "cuda:0"):
+    def load_model(self, model_path: str = None, device: str = "cuda:0", use_server: bool = None,
+                   backend: str = None, num_threads: int = None):
         if model_path is None:
             model_path = "BAAI/bge-large-en-v1.5"
+        if backend is None:
+            backend = os.environ.get("AUTOLINK_EMBED_BACKEND", "torch")
+        if num_threads is None and os.environ.get("AUTOLINK_EMBED_THREADS"):
+            num_threads = int(os.environ["AUTOLINK_EMBED_THREADS"])
+        
+        socket_path = os.environ.get(EMBED_SERVER_ENV) if use_server is not False else None
+        if socket_path:
+            self.connect(socket_path, model_path)
+            return
                     
+        # Resolve the device before comparing, so a CPU fallback is not reloaded on every call.
+        requested_device = device
+        if device.startswith("cuda") and (backend != "torch" or not torch.cuda.is_available()):
+            device = "cpu"
+        
         with self.model_lock:
-            if self.model is None or self.device != device:
-                print(f"Loading model from {model_path} to {device}")
-                if device.startswith("cuda") and not torch.cuda.is_available():
-                    device = "cpu"
-                    print("CUDA not available, falling back to CPU")
+            if self.model is None or self.device != device or self.backend != backend:
+                print(f"Loading model from {model_path} to {device} ({backend} backend)")
+                if device != requested_device:
+                    print("CUDA not available, falling back to CPU" if backend == "torch"
+                          else f"The {backend} backend runs on CPU")
                 
-                self.model = SentenceTransformer(model_path, device=device)
+                self.model = load_sentence_transformer(model_path, device, backend, num_threads)
                 self.device = device
+                self.backend = backend
+                self.model_path = model_path
                 print(f"Model loaded successfully on {device}")
                 
                 if device.startswith("cuda"):
@@ -42,16 +99,75 @@ class ModelManager:
                     memory_reserved = torch.cuda.memory_reserved(gpu_id) / 1024**3
                     print(f"GPU {gpu_id} Memory - Allocated: {memory_allocated:.2f}GB, Reserved: {memory_reserved:.2f}GB")
     
+    def connect(self, socket_path: str, model_path: str = None):
+        """Send encode requests to the embedding server at ``socket_path`` instead of a local model."""
+        with self.model_lock:
+            if self.client is None or self.client.socket_path != socket_path:
+                if not wait_for_server(socket_path):
+                    raise RuntimeError(f"Embedding server not reachable at {socket_path}")
+                self.client = EmbeddingClient(socket_path)
+                # Take the model and backend from the server, so cached embeddings
+                # are keyed on what actually produced them.
+                info = self.client.server_info()
+                self.device = f"server:{socket_path}"
+                self.model_path = info["model_path"]
+                self.backend = info["backend"]
+                if model_path and model_path != self.model_path:
+                    print(f"Embedding server runs {self.model_path}, not the requested {model_path}")
+                print(f"Using embedding server at {socket_path} ({self.model_path}, {self.backend} backend)")
+    
     def get_model(self):
         if self.model is None:
             raise RuntimeError("Model not loaded. Call load_model() first.")
         return self.model
     
     def encode(self, text: str):
+        key = EmbeddingCache.make_key(self._cache_name(), text)
+        embedding = self.embedding_cache.get(key)
+        if embedding is not None:
+            return embedding
+        if self.client is not None:
+            return self.embedding_cache.put(key, self.client.encode([text])[0])
+        return self.embedding_cache.put(key, self.batcher.submit([text])[0])
+    
+    def encode_batch(self, texts: list, batch_size: int = 64):
+        keys = [EmbeddingCache.make_key(self._cache_name(), text) for text in texts]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            if self.client is not None:
+                encoded = self.client.encode(missing_texts, batch_size=batch_size)
+            elif len(missing_texts) < self.batcher.max_batch_size:
+                encoded = self.batcher.submit(missing_texts)
+            else:
+                encoded = self._encode_texts(missing_texts, batch_size)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = self.embedding_cache.put(keys[i], embedding)
+        return np.stack(embeddings)
+    
+    def _cache_name(self):
+        if self.backend in (None, "torch"):
+            return str(self.model_path)
+        return f"{self.model_path}@{self.backend}"
+    
+    def _encode_texts(self, texts: list, batch_size: int = None):
         with self.model_lock:
             if self.model is None:
                 raise RuntimeError("Model not loaded. Call load_model() first.")
-            return self.model.encode(text, convert_to_numpy=True)
+            return self.model.encode(texts, batch_size=batch_size or self.batcher.max_batch_size,
+                                     convert_to_numpy=True)
+    
+    def get_batch_stats(self):
+        return self.batcher.stats()
+    
+    def get_cache_stats(self):
+        return self.embedding_cache.stats()
+    
+    def get_server_stats(self):
+        if self.client is None:
+            return None
+        return self.client.stats()
     
     def get_device(self):
         return self.device
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+from config import USER_INPUT
+
+
+# Off unless AUTOLINK_PROMPT_TOKEN_BUDGET or --token_budget opts in, so prompts
+# match the unbudgeted pipeline by default.
+DEFAULT_TOKEN_BUDGET = 0
+DEFAULT_TOKENIZER = "cl100k_base"
+PROMPT_TOKENS_FILE = "prompt_tokens.json"
+
+# Schema reductions, applied cumulatively until the user input fits the budget.
+SCHEMA_LEVELS = ["full", "no_sample_values", "short_descriptions", "collapsed_similar_tables"]
+DESCRIPTION_LIMIT = 150
+SIMILAR_TABLES_LIMIT = 3
+
+TABLE_HEADER_PATTERN = re.compile(r"^###Table full name: (.*)$", re.MULTILINE)
+# Fallback without tiktoken: words in chunks of up to 4 characters plus
+# punctuation, which tracks BPE counts on schema text and JSON closely enough.
+HEURISTIC_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+
+_encoder = None
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(os.environ.get("AUTOLINK_TOKENIZER", DEFAULT_TOKENIZER))
+        except Exception:
+            # Not installed, or the encoding file cannot be fetched offline.
+            _encoder = False
+    return _encoder
+
+
+def tokenizer_name() -> str:
+    encoder = _get_encoder()
+    return encoder.name if encoder else "heuristic"
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return len(HEURISTIC_TOKEN_PATTERN.findall(text))
+
+
+def token_budget() -> int:
+    """AUTOLINK_PROMPT_TOKEN_BUDGET; 0 (the default) disables fitting."""
+    return int(os.environ.get("AUTOLINK_PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+
+
+def recorded_budget(log_path: str) -> int:
+    """The budget generate_schema used for ``log_path``, else token_budget()."""
+    path = os.path.join(log_path, PROMPT_TOKENS_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["budget"]
+    return token_budget()
+
+
+def _fit_tables(all_tables: list, keep: set, limit: int):
+    """Keep the retrieved tables, then others in order while they fit in ``limit`` tokens."""
+    kept = [table for table in all_tables if table in keep]
+    used = count_tokens(json.dumps(kept, ensure_ascii=False))
+    for table in all_tables:
+        if table in keep:
+            continue
+        cost = count_tokens(json.dumps(table, ensure_ascii=False)) + 1
+        if used + cost > limit:
+            break
+        kept.append(table)
+        used += cost
+    kept_set = set(kept)
+    tables = [table for table in all_tables if table in kept_set]
+    dropped = len(all_tables) - len(tables)
+    if dropped:
+        tables.append(f"... ({dropped} more tables)")
+    return tables, dropped
+
+
+def _truncate_to_tokens(text: str, limit: int, suffix: str = "...(truncated)") -> str:
+    limit -= count_tokens(suffix)
+    if limit <= 0:
+        return ""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + suffix
+
+
+def fit_user_input(render_schema, question: str, knowledge: str, all_tables: list, budget: int = None):
+    """Format USER_INPUT within ``budget`` tokens.
+
+    ``render_schema`` is the schema text, or a callable taking an index into
+    SCHEMA_LEVELS. Reductions are applied in order until the message fits:
+    the schema levels (sample values, descriptions, similar tables), then
+    ALL_TABLES down to the retrieved tables, then the external knowledge.
+    Returns ``(schema_text, user_input, usage)``; ``usage`` has the tokens
+    of each section and the reductions applied.
+    """
+    if budget is None:
+        budget = token_budget()
+    max_level = len(SCHEMA_LEVELS) - 1
+    if isinstance(render_schema, str):
+        # Already rendered (and reduced) by generate_schema.
+        schema_text, max_level = render_schema, 0
+        render_schema = lambda level: schema_text
+
+    template_tokens = count_tokens(USER_INPUT.format(RETRIEVED_SCHEMA="", USER_QUESTION="", EXTERNAL_KNOWLEDGE="",
+                                                     ALL_TABLES=""))
+    question_tokens = count_tokens(question)
+    knowledge_tokens = count_tokens(knowledge)
+    tables_text = json.dumps(all_tables, ensure_ascii=False)
+    tables_tokens = count_tokens(tables_text)
+
+    def fits(*section_tokens):
+        return not budget or template_tokens + question_tokens + sum(section_tokens) <= budget
+
+    level = 0
+    schema_text = render_schema(level)
+    schema_tokens = count_tokens(json.dumps(schema_text, ensure_ascii=False))
+    while not fits(schema_tokens, tables_tokens, knowledge_tokens) and level < max_level:
+        level += 1
+        schema_text = render_schema(level)
+        schema_tokens = count_tokens(json.dumps(schema_text, ensure_ascii=False))
+
+    tables_dropped = 0
+    if not fits(schema_tokens, tables_tokens, knowledge_tokens):
+        limit = budget - template_tokens - question_tokens - schema_tokens - knowledge_tokens
+        keep = set(TABLE_HEADER_PATTERN.findall(schema_text))
+        tables, tables_dropped = _fit_tables(all_tables, keep, limit)
+        tables_text = json.dumps(tables, ensure_ascii=False)
+        tables_tokens = count_tokens(tables_text)
+
+    knowledge_truncated = False
+    if knowledge_tokens and not fits(schema_tokens, tables_tokens, knowledge_tokens):
+        limit = budget - template_tokens - question_tokens - schema_tokens - tables_tokens
+        knowledge = _truncate_to_tokens(knowledge, limit)
+        knowledge_tokens = count_tokens(knowledge)
+        knowledge_truncated = True
+
+    user_input = USER_INPUT.format(
+        RETRIEVED_SCHEMA=json.dumps(schema_text, ensure_ascii=False),
+        USER_QUESTION=question,
+        EXTERNAL_KNOWLEDGE=knowledge,
+        ALL_TABLES=tables_text,
+    )
+    total = template_tokens + question_tokens + schema_tokens + tables_tokens + knowledge_tokens
+    usage = {
+        "budget": budget,
+        "total": total,
+        "over_budget": bool(budget) and total > budget,
+        "sections": {
+            "template": template_tokens,
+            "schema": schema_tokens,
+            "all_tables": tables_tokens,
+            "external_knowledge": knowledge_tokens,
+            "question": question_tokens,
+        },
+        "schema_level": SCHEMA_LEVELS[level] if max_level else None,
+        "tables_dropped": tables_dropped,
+        "knowledge_truncated": knowledge_truncated,
+    }
+    return schema_text, user_input, usage
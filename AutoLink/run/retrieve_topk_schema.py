@@ -4,9 +4,16 @@ import multiprocessing as mp
 from tqdm import tqdm
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from utils import *
+from index_cache import index_cache, database_size
+from state_store import STATE_FILE, get_state_store
+from index_bitmap import IndexBitmap
 import argparse
+import queue
+import time
+
+SELECTOR_MIN_EXCLUDED = 1024
+RETRIEVAL_CHUNK_SIZE = 32
 
 def sliding_window_table_match(metadata_table: str, target_table: str) -> bool:
     metadata_parts = metadata_table.lower().split('.')
@@ -24,136 +31,196 @@ def sliding_window_table_match(metadata_table: str, target_table: str) -> bool:
     
     return False
 
+def _table_windows(table_name: str) -> set:
+    parts = table_name.lower().split('.')
+    return {tuple(parts[i:j]) for i in range(len(parts)) for j in range(i + 1, len(parts) + 1)}
+
+
+def build_name_lookup(metadata_mapping) -> dict:
+    """Map lowercase column name to its rows with precomputed table windows.
+
+    Each row is ``(index, windows, masked_windows)`` where the windows are every
+    contiguous run of table-name parts, so sliding_window_table_match becomes a
+    set lookup. Rows keep metadata order.
+    """
+    table_windows = {}
+    lookup = {}
+    for idx, metadata in enumerate(metadata_mapping):
+        table = metadata["table"]
+        if table not in table_windows:
+            table_windows[table] = (_table_windows(table), _table_windows(mask_digits(table)))
+        windows, masked_windows = table_windows[table]
+        lookup.setdefault(metadata["column"].lower(), []).append((idx, windows, masked_windows))
+    return lookup
+
+
 def find_with_name(column_name: str, table_name: str, db_name: str, embed_path: str):
-    metadata_path = os.path.join(embed_path, db_name, "metadata.json")
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        metadata_mapping = json.load(f)
+    _, metadata_mapping = index_cache.get(embed_path, db_name)
+    name_lookup = index_cache.get_derived(embed_path, db_name, "name_lookup", build_name_lookup)
+    candidates = name_lookup.get(column_name.lower(), [])
     
-    is_find = False
     result = []
     
-    for idx, metadata in enumerate(metadata_mapping):
-        if (metadata["column"].lower() == column_name.lower() and 
-            sliding_window_table_match(metadata["table"], table_name)):
-            is_find = True
+    target_window = tuple(table_name.lower().split('.'))
+    for idx, windows, _ in candidates:
+        if target_window in windows:
+            metadata = metadata_mapping[idx]
             print("Exact match found:", metadata["column"], metadata["table"])
             result.append({
                 "index": int(idx),
                 "metadata": metadata
             })
     
-    if not is_find:
-        for idx, metadata in enumerate(metadata_mapping):
-            if (metadata["column"].lower() == column_name.lower() and 
-                sliding_window_table_match(mask_digits(metadata["table"]), mask_digits(table_name))):
-                is_find = True
+    if not result:
+        masked_window = tuple(mask_digits(table_name).lower().split('.'))
+        for idx, _, masked_windows in candidates:
+            if masked_window in masked_windows:
+                metadata = metadata_mapping[idx]
                 print("Partial match found:", metadata["column"], metadata["table"])
                 result.append({
                     "index": int(idx),
                     "metadata": metadata
                 })
     
-    if not is_find:
-        max_count=5
-        for idx, metadata in enumerate(metadata_mapping):
-            if metadata["column"].lower() == column_name.lower():
-                is_find = True
-                print("Column match found:", metadata["column"], metadata["table"])
-                result.append({
-                    "index": int(idx),
-                    "metadata": metadata
-                })
-                max_count -= 1
-                if max_count <= 0:
-                    break
+    if not result:
+        for idx, _, _ in candidates[:5]:
+            metadata = metadata_mapping[idx]
+            print("Column match found:", metadata["column"], metadata["table"])
+            result.append({
+                "index": int(idx),
+                "metadata": metadata
+            })
     
-    if not is_find:
+    if not result:
         return "No matching column found. Please check the column name and table name."
     else:
         return result
 
-def _retrieve_with_device_filtered(question: str, db_name: str, embed_path: str, 
-                                 excluded_indices: set, top_k: int = 5, device: str = "cuda:0"):
-    from model_manager import model_manager
-    index_path = os.path.join(embed_path, db_name, "index.faiss")
-    index = faiss.read_index(index_path)
-    metadata_path = os.path.join(embed_path, db_name, "metadata.json")
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        metadata_mapping = json.load(f)
-    model_manager.load_model(device=device)
-    question_embedding = model_manager.encode(question)
-    distances, indices = index.search(question_embedding.reshape(1, -1), len(metadata_mapping))
-    filtered_results = []
-    
-    for i in range(len(indices[0])):
-        idx = int(indices[0][i])
-        if 0 <= idx < len(metadata_mapping) and idx not in excluded_indices:
-            metadata = metadata_mapping[idx]
-            filtered_results.append({
-                "index": idx,
-                "distance": float(distances[0][i]),
-                "metadata": metadata
-            })
+def prepare_queries(embeddings, params: dict):
+    queries = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, np.shape(embeddings)[-1])
+    if params.get("normalize", False):
+        queries = queries.copy()
+        faiss.normalize_L2(queries)
+    return queries
+
+
+def search_excluding(index, metadata_mapping, query_embedding, excluded_indices, top_k: int):
+    total = len(metadata_mapping)
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    excluded = as_bitmap(excluded_indices)
+    num_excluded = excluded.count()
+    
+    if num_excluded > SELECTOR_MIN_EXCLUDED and hasattr(faiss, "IDSelectorBitmap"):
+        # Large exclusion sets are filtered inside FAISS instead of over-fetching.
+        packed = excluded.packed(total)
+        selector = faiss.IDSelectorNot(faiss.IDSelectorBitmap(len(packed), faiss.swig_ptr(packed)))
+        params = _selector_search_params(index, selector)
+        try:
+            distances, indices = index.search(query, min(top_k, total), params=params)
+            filtered_results = _collect_results(distances[0], indices[0], metadata_mapping, excluded, top_k)
             if len(filtered_results) >= top_k:
-                break
-    
-    return filtered_results, len(metadata_mapping)
-
-
-def load_instance_cache(instance_id: str, cache_dir: str):
-    cache_file = os.path.join(cache_dir, f"{instance_id}.json")
-    if os.path.exists(cache_file):
-        with open(cache_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"used_indices": []}
-
+                return filtered_results
+        except RuntimeError:
+            pass
+    
+    # At most |excluded| hits can be filtered out, so top_k + |excluded| is enough for exact
+    # indexes. Approximate indexes may return fewer (-1 padded) hits, so k grows adaptively;
+    # an IVF index cannot return more than its probed lists hold, so the last resort
+    # searches every list.
+    k = min(total, top_k + num_excluded)
+    params = None
+    while True:
+        try:
+            distances, indices = index.search(query, k, params=params)
+        except RuntimeError:
+            if params is None:
+                raise
+            # Search parameters not supported by this index wrapper.
+            return filtered_results
+        filtered_results = _collect_results(distances[0], indices[0], metadata_mapping, excluded, top_k)
+        if len(filtered_results) >= top_k:
+            return filtered_results
+        if k < total:
+            k = min(total, k * 2)
+        elif params is None and _exhaustive_search_params(index) is not None:
+            params = _exhaustive_search_params(index)
+        else:
+            return filtered_results
+
+
+def _selector_search_params(index, selector):
+    # Typed parameters keep the nprobe/efSearch configured from index_params.json.
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf_index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _exhaustive_search_params(index):
+    """Search parameters that visit the whole index, or None if it already does."""
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        return faiss.SearchParametersIVF(nprobe=ivf_index.nlist) if ivf_index.nprobe < ivf_index.nlist else None
+    if isinstance(index, faiss.IndexHNSW) and index.hnsw.efSearch < index.ntotal:
+        return faiss.SearchParametersHNSW(efSearch=index.ntotal)
+    return None
+
+
+def search_excluding_batch(index, metadata_mapping, query_embeddings, excluded_list: list, top_k: int):
+    total = len(metadata_mapping)
+    queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(excluded_list), -1)
+    excluded_list = [as_bitmap(excluded) for excluded in excluded_list]
+    k = min(total, top_k + max(excluded.count() for excluded in excluded_list))
+    distances, indices = index.search(queries, k)
+    
+    batch_results = []
+    for row, excluded in enumerate(excluded_list):
+        filtered_results = _collect_results(distances[row], indices[row], metadata_mapping, excluded, top_k)
+        if len(filtered_results) < top_k and (k < total or _exhaustive_search_params(index) is not None):
+            filtered_results = search_excluding(index, metadata_mapping, queries[row], excluded, top_k)
+        batch_results.append(filtered_results)
+    return batch_results
 
-def save_instance_cache(instance_id: str, cache_dir: str, cache_data: dict):
-    os.makedirs(cache_dir, exist_ok=True)
-    if "used_indices" in cache_data:
-        cache_data["used_indices"] = [int(idx) for idx in cache_data["used_indices"]]
-    
-    cache_file = os.path.join(cache_dir, f"{instance_id}.json")
-    with open(cache_file, "w", encoding="utf-8") as f:
-        json.dump(cache_data, f, ensure_ascii=False, indent=2)
 
+def as_bitmap(excluded_indices) -> IndexBitmap:
+    if isinstance(excluded_indices, IndexBitmap):
+        return excluded_indices
+    return IndexBitmap.from_indices(excluded_indices)
 
-def load_instance_status(instance_id: str, status_dir: str):
-    status_file = os.path.join(status_dir, f"{instance_id}.json")
-    if os.path.exists(status_file):
-        with open(status_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {
-        "is_complete": False,
-        "total_available": 0,
-        "used_count": 0,
-        "remaining_count": 0
-    }
 
+def _collect_results(distances, indices, metadata_mapping, excluded: IndexBitmap, top_k):
+    indices = np.asarray(indices, dtype=np.int64)
+    keep = (indices >= 0) & (indices < len(metadata_mapping)) & ~excluded.mask(indices)
+    filtered_results = []
+    for position in np.flatnonzero(keep)[:top_k]:
+        idx = int(indices[position])
+        filtered_results.append({
+            "index": idx,
+            "distance": float(distances[position]),
+            "metadata": metadata_mapping[idx]
+        })
+    return filtered_results
 
-def save_instance_status(instance_id: str, status_dir: str, status_data: dict):
-    os.makedirs(status_dir, exist_ok=True)
 
-    cleaned_status = {}
-    for key, value in status_data.items():
-        if isinstance(value, (np.integer, np.int64, np.int32)):
-            cleaned_status[key] = int(value)
-        elif isinstance(value, (np.floating, np.float64, np.float32)):
-            cleaned_status[key] = float(value)
-        else:
-            cleaned_status[key] = value
+def _retrieve_with_device_filtered(question: str, db_name: str, embed_path: str, 
+                                 excluded_indices, top_k: int = 5, device: str = "cuda:0"):
+    from model_manager import model_manager
+    index, metadata_mapping, params = index_cache.get_with_params(embed_path, db_name)
+    model_manager.load_model(device=device)
+    question_embedding = prepare_queries(model_manager.encode(question), params)
+    filtered_results = search_excluding(index, metadata_mapping, question_embedding, excluded_indices, top_k)
     
-    status_file = os.path.join(status_dir, f"{instance_id}.json")
-    with open(status_file, "w", encoding="utf-8") as f:
-        json.dump(cleaned_status, f, ensure_ascii=False, indent=2)
+    return filtered_results, len(metadata_mapping)
 
 
 def get_next_k_results(instance_id: str, question: str, db_name: str, embed_path: str, 
-                      top_k: int, cache_dir: str, status_dir: str, device: str):
-    cache = load_instance_cache(instance_id, cache_dir)
-    status = load_instance_status(instance_id, status_dir)
+                      top_k: int, log_dir: str, device: str):
+    state_store = get_state_store(log_dir)
+    cache, status = state_store.load(instance_id)
     
-    used_indices = set(cache.get("used_indices", []))
+    used_indices = cache["used_indices"]
     
     if status.get("is_complete", False):
         print(f"Instance {instance_id} retrieve all completed.")
@@ -168,18 +235,23 @@ def get_next_k_results(instance_id: str, question: str, db_name: str, embed_path
         device=device
     )
     
+    return _record_results(state_store, instance_id, cache, status, results, total_available, top_k)
+
+
+def _record_results(state_store, instance_id: str, cache: dict, status: dict, results: list,
+                    total_available: int, top_k: int):
+    used_indices = cache["used_indices"]
+    
     if status.get("total_available", 0) == 0:
         status["total_available"] = total_available
     
-    new_used_indices = [int(result["index"]) for result in results]
-    all_used_indices = list(used_indices) + new_used_indices
-    
-    cache["used_indices"] = all_used_indices
-    save_instance_cache(instance_id, cache_dir, cache)
+    used_indices.resize(total_available)
+    used_indices.add_many([int(result["index"]) for result in results])
     
-    used_count = len(all_used_indices)
+    used_count = used_indices.count()
     remaining_count = total_available - used_count
-    is_complete = len(results) < top_k or remaining_count <= 0
+    # A short result on an approximate index does not mean the database is exhausted.
+    is_complete = remaining_count <= 0
     
     status = {
         "is_complete": is_complete,
@@ -187,7 +259,7 @@ def get_next_k_results(instance_id: str, question: str, db_name: str, embed_path
         "used_count": int(used_count),
         "remaining_count": int(remaining_count)
     }
-    save_instance_status(instance_id, status_dir, status)
+    state_store.save(instance_id, cache, status)
     
     metadata_mapping = {}
     for result in results:
@@ -199,44 +271,87 @@ def get_next_k_results(instance_id: str, question: str, db_name: str, embed_path
         return results, metadata_mapping, ""
 
 
-def process_batch_with_device(batch_items, device_id, top_k, log_dir):
+def get_next_k_results_batch(instance_questions: dict, db_name: str, embed_path: str,
+                             top_k: int, log_dir: str, device: str):
+    """Batched get_next_k_results for instances that share one database.
+
+    All questions are encoded in one forward pass and searched with one
+    multi-query index.search; per-instance state is updated as before.
+    """
+    from model_manager import model_manager
+    state_store = get_state_store(log_dir)
+    outputs = {}
+    pending = []
+    
+    for instance_id, question in instance_questions.items():
+        cache, status = state_store.load(instance_id)
+        if status.get("is_complete", False):
+            print(f"Instance {instance_id} retrieve all completed.")
+            outputs[instance_id] = ([], {}, "All columns in this databases are retrieved. There is no need to retrieve again.")
+            continue
+        pending.append((instance_id, question, cache, status))
+    
+    if not pending:
+        return outputs
+    
+    index, metadata_mapping, params = index_cache.get_with_params(embed_path, db_name)
+    model_manager.load_model(device=device)
+    question_embeddings = prepare_queries(model_manager.encode_batch([question for _, question, _, _ in pending]),
+                                          params)
+    excluded_list = [cache["used_indices"] for _, _, cache, _ in pending]
+    
+    batch_results = search_excluding_batch(index, metadata_mapping, question_embeddings, excluded_list, top_k)
+    
+    for (instance_id, _, cache, status), results in zip(pending, batch_results):
+        outputs[instance_id] = _record_results(state_store, instance_id, cache, status, results,
+                                               len(metadata_mapping), top_k)
+    return outputs
+
+
+def _load_worker_model(device_id):
     print(f"process {os.getpid()} - GPU {device_id}: loading model...")
     try:
         from model_manager import model_manager
         model_manager.load_model(device=f"cuda:{device_id}")
         memory_info = model_manager.get_memory_usage()
-        if memory_info:
+        if model_manager.client is not None:
+            print(f"process {os.getpid()} - GPU {device_id}: using {model_manager.get_device()}")
+        elif memory_info:
             print(f"process {os.getpid()} - GPU {device_id}: model has load to {memory_info['device']}")
         else:
             print(f"process {os.getpid()} - GPU {device_id}: model has load to CPU")
     except Exception as e:
         print(f"process {os.getpid()} - GPU {device_id}: model load failed: {e}")
         print(f"process {os.getpid()} - GPU {device_id}: will use CPU mode")
-        model_manager.load_model(device="cpu")
-    
+        model_manager.load_model(device="cpu", use_server=False)
+
+
+def _retrieve_items(batch_items, device_id, top_k, log_dir, progress):
     batch_results = {}
     
-    cache_dir = os.path.join(log_dir, "cache")
-    status_dir = os.path.join(log_dir, "status")
-    
     device = f"cuda:{device_id}"
     
-    for instance_id, item in tqdm(batch_items.items(), desc=f"GPU {device_id} - 进程 {os.getpid()}"):
-        question = item["question"]
-        db_name = item["db_name"]
-
+    db_groups = {}
+    for instance_id, item in batch_items.items():
         embed_path = determine_embedding_path(instance_id)
+        db_groups.setdefault((embed_path, item["db_name"]), {})[instance_id] = item["question"]
 
-        results, metadata_mapping, completion_message = get_next_k_results(
-            instance_id=instance_id,
-            question=question,
+    retrieved = {}
+    for (embed_path, db_name), instance_questions in db_groups.items():
+        retrieved.update(get_next_k_results_batch(
+            instance_questions=instance_questions,
             db_name=db_name,
             embed_path=embed_path,
             top_k=top_k,
-            cache_dir=cache_dir,
-            status_dir=status_dir,
+            log_dir=log_dir,
             device=device
-        )
+        ))
+        progress.update(len(instance_questions))
+
+    for instance_id, item in batch_items.items():
+        question = item["question"]
+        db_name = item["db_name"]
+        results, metadata_mapping, completion_message = retrieved[instance_id]
 
         table_candidates = []
         column_candidates = []
@@ -276,10 +391,113 @@ def process_batch_with_device(batch_items, device_id, top_k, log_dir):
     return batch_results
 
 
-def retrieve_additional(instance_id: str, question: str, additional_k: int, log_dir: str, device: str = "cuda:0"):
-    cache_dir = os.path.join(log_dir, "cache")
-    status_dir = os.path.join(log_dir, "status")
+def process_batch_with_device(batch_items, device_id, top_k, log_dir):
+    _load_worker_model(device_id)
     
+    progress = tqdm(total=len(batch_items), desc=f"GPU {device_id} - 进程 {os.getpid()}")
+    batch_results = _retrieve_items(batch_items, device_id, top_k, log_dir, progress)
+    progress.close()
+
+    from model_manager import model_manager
+    print(f"process {os.getpid()} - GPU {device_id}: index cache {index_cache.stats()}")
+    print(f"process {os.getpid()} - GPU {device_id}: embedding cache {model_manager.get_cache_stats()}")
+    server_stats = model_manager.get_server_stats()
+    if server_stats:
+        print(f"process {os.getpid()} - GPU {device_id}: embedding server {server_stats}")
+
+    return batch_results
+
+
+def process_queue_with_device(task_queues, device_id, top_k, log_dir):
+    """Drain this worker's own queue (``task_queues[device_id]``), then steal chunks from the others.
+
+    Every database's chunks sit in its owner's queue, so a database index is
+    only loaded by a second worker once that worker has run out of its own.
+    """
+    _load_worker_model(device_id)
+    
+    progress = tqdm(desc=f"GPU {device_id} - 进程 {os.getpid()}")
+    batch_results = {}
+    loaded_databases = set()
+    num_tasks = 0
+    start_time = time.time()
+
+    own_queue = task_queues[device_id]
+    num_stolen = 0
+    while True:
+        try:
+            db_key, batch_items = own_queue.get_nowait()
+        except queue.Empty:
+            # Own databases done: help with the chunks of the busiest other worker.
+            others = sorted((q for i, q in enumerate(task_queues) if i != device_id), key=lambda q: q.qsize(),
+                            reverse=True)
+            for other in others:
+                try:
+                    db_key, batch_items = other.get_nowait()
+                    num_stolen += 1
+                    break
+                except queue.Empty:
+                    continue
+            else:
+                break
+        batch_results.update(_retrieve_items(batch_items, device_id, top_k, log_dir, progress))
+        loaded_databases.add(db_key)
+        num_tasks += 1
+    progress.close()
+
+    print(f"process {os.getpid()} - GPU {device_id}: {num_tasks} tasks ({num_stolen} stolen), "
+          f"{len(batch_results)} instances, {len(loaded_databases)} databases in {time.time() - start_time:.1f}s")
+    from model_manager import model_manager
+    print(f"process {os.getpid()} - GPU {device_id}: index cache {index_cache.stats()}")
+    print(f"process {os.getpid()} - GPU {device_id}: embedding cache {model_manager.get_cache_stats()}")
+    server_stats = model_manager.get_server_stats()
+    if server_stats:
+        print(f"process {os.getpid()} - GPU {device_id}: embedding server {server_stats}")
+
+    return batch_results
+
+
+def schedule_retrieval_tasks(spider2_data: dict, chunk_size: int = RETRIEVAL_CHUNK_SIZE):
+    """Group instances by database, largest database first.
+
+    Groups larger than chunk_size are split into consecutive chunks, so idle
+    workers can steal the rest of a big database instead of waiting.
+    """
+    db_groups = {}
+    for instance_id, item in spider2_data.items():
+        db_key = (determine_embedding_path(instance_id), item["db_name"])
+        db_groups.setdefault(db_key, {})[instance_id] = item
+
+    db_sizes = {db_key: database_size(*db_key) for db_key in db_groups}
+    ordered_keys = sorted(db_groups, key=lambda db_key: (db_sizes[db_key], len(db_groups[db_key])), reverse=True)
+
+    tasks = []
+    for db_key in ordered_keys:
+        items = list(db_groups[db_key].items())
+        for i in range(0, len(items), chunk_size):
+            tasks.append((db_key, dict(items[i:i + chunk_size])))
+    return tasks
+
+
+def assign_database_owners(tasks: list, num_workers: int) -> list:
+    """Split tasks into one list per worker, keeping all chunks of a database together.
+
+    Databases are taken in task order (largest first) and each goes to the
+    worker with the fewest instances so far.
+    """
+    owners = {}
+    loads = [0] * num_workers
+    worker_tasks = [[] for _ in range(num_workers)]
+    for db_key, batch_items in tasks:
+        if db_key not in owners:
+            owners[db_key] = loads.index(min(loads))
+        owner = owners[db_key]
+        worker_tasks[owner].append((db_key, batch_items))
+        loads[owner] += len(batch_items)
+    return worker_tasks
+
+
+def retrieve_additional(instance_id: str, question: str, additional_k: int, log_dir: str, device: str = "cuda:0"):
     with open("spider2_data.json", "r", encoding="utf-8") as f:
         spider2_data = json.load(f)
     
@@ -295,8 +513,7 @@ def retrieve_additional(instance_id: str, question: str, additional_k: int, log_
         db_name=db_name,
         embed_path=embed_path,
         top_k=additional_k,
-        cache_dir=cache_dir,
-        status_dir=status_dir,
+        log_dir=log_dir,
         device=device
     )
     
@@ -325,27 +542,25 @@ def retrieve(log_dir: str, top_n: int = 50):
 
     visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES", "0").split(",")
     num_gpus = len(visible_devices)
-    
-    batch_size = len(instance_ids) // num_gpus
-    if batch_size == 0:
-        batch_size = 1
 
-    batches = []
-    for i in range(num_gpus):
-        start_idx = i * batch_size
-        if i == num_gpus - 1: 
-            end_idx = len(instance_ids)
-        else:
-            end_idx = (i + 1) * batch_size
-        
-        if start_idx < len(instance_ids):
-            batch = {instance_id: spider2_data[instance_id] for instance_id in instance_ids[start_idx:end_idx]}
-            batches.append((batch, i, top_n, log_dir))
+    tasks = schedule_retrieval_tasks(spider2_data)
+    get_state_store(log_dir)
+    num_workers = max(1, min(num_gpus, len(tasks)))
 
     mp.set_start_method('spawn', force=True)
     
-    with mp.Pool(processes=len(batches)) as pool:
-        batch_results = pool.starmap(process_batch_with_device, batches)
+    manager = mp.Manager()
+    task_queues = []
+    for worker_tasks in assign_database_owners(tasks, num_workers):
+        task_queue = manager.Queue()
+        for task in worker_tasks:
+            task_queue.put(task)
+        task_queues.append(task_queue)
+    
+    with mp.Pool(processes=num_workers) as pool:
+        batch_results = pool.starmap(process_queue_with_device,
+                                     [(task_queues, i, top_n, log_dir) for i in range(num_workers)])
+    manager.shutdown()
 
     all_candidates = {}
     for instance_id in instance_ids:
@@ -358,8 +573,7 @@ def retrieve(log_dir: str, top_n: int = 50):
         json.dump(all_candidates, f, ensure_ascii=False, indent=2)
         
     print(f"Retrieval completed, results saved to {log_dir}/")
-    print(f"Cache saved to {log_dir}/cache/")
-    print(f"Status saved to {log_dir}/status/")
+    print(f"Cache and status saved to {log_dir}/{STATE_FILE}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import os
+import json
+import glob
+import sqlite3
+import threading
+from contextlib import contextmanager
+from index_bitmap import IndexBitmap
+
+
+STATE_FILE = "state.sqlite"
+
+STATE_COLUMNS = ["used_indices", "is_complete", "total_available", "used_count", "remaining_count"]
+
+
+def default_cache():
+    return {"used_indices": IndexBitmap()}
+
+
+def default_status():
+    return {
+        "is_complete": False,
+        "total_available": 0,
+        "used_count": 0,
+        "remaining_count": 0
+    }
+
+
+class StateStore:
+    """Per-log_path SQLite store of instance retrieval state.
+
+    Each row holds an instance's used indices (a compressed IndexBitmap) and
+    status counters, so both are updated in one atomic statement.
+    ``backup``/``restore`` snapshot a row into a separate table. Existing
+    ``cache/``, ``status/`` and ``backup/`` JSON files are imported the first
+    time a store is created for a log path.
+    """
+
+    def __init__(self, log_path: str):
+        os.makedirs(log_path, exist_ok=True)
+        self.log_path = log_path
+        self.path = os.path.join(log_path, STATE_FILE)
+        is_new = not os.path.exists(self.path)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for table in ("instance_state", "instance_backup"):
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    instance_id TEXT PRIMARY KEY,
+                    used_indices BLOB NOT NULL,
+                    is_complete INTEGER NOT NULL,
+                    total_available INTEGER NOT NULL,
+                    used_count INTEGER NOT NULL,
+                    remaining_count INTEGER NOT NULL
+                )""")
+        if is_new:
+            self._import_json_state()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def load(self, instance_id: str):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(STATE_COLUMNS)} FROM instance_state WHERE instance_id = ?", (instance_id,)
+            ).fetchone()
+        if row is None:
+            return default_cache(), default_status()
+        return self._decode(row)
+
+    def load_status(self, instance_id: str):
+        return self.load(instance_id)[1]
+
+    def load_all_status(self):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT instance_id, {', '.join(STATE_COLUMNS)} FROM instance_state").fetchall()
+        return {row[0]: self._decode(row[1:])[1] for row in rows}
+
+    def save(self, instance_id: str, cache: dict, status: dict):
+        with self.lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO instance_state (instance_id, {', '.join(STATE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                (instance_id,) + self._encode(cache, status)
+            )
+
+    def backup(self, instance_id: str):
+        # Like the JSON backups, an existing snapshot is never overwritten.
+        with self.lock:
+            self.conn.execute(
+                f"INSERT OR IGNORE INTO instance_backup SELECT * FROM instance_state WHERE instance_id = ?", (instance_id,)
+            )
+
+    def restore(self, instance_id: str):
+        with self.transaction():
+            row = self.conn.execute("SELECT 1 FROM instance_backup WHERE instance_id = ?", (instance_id,)).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO instance_state SELECT * FROM instance_backup WHERE instance_id = ?", (instance_id,)
+                )
+
+    @staticmethod
+    def _encode(cache: dict, status: dict):
+        used_indices = cache.get("used_indices", [])
+        if not isinstance(used_indices, IndexBitmap):
+            used_indices = IndexBitmap.from_indices(used_indices)
+        return (
+            used_indices.to_bytes(),
+            int(bool(status.get("is_complete", False))),
+            int(status.get("total_available", 0)),
+            int(status.get("used_count", 0)),
+            int(status.get("remaining_count", 0)),
+        )
+
+    @staticmethod
+    def _decode(row):
+        if isinstance(row[0], str):
+            used_indices = IndexBitmap.from_indices(json.loads(row[0]))
+        else:
+            used_indices = IndexBitmap.from_bytes(row[0])
+        cache = {"used_indices": used_indices}
+        status = {
+            "is_complete": bool(row[1]),
+            "total_available": row[2],
+            "used_count": row[3],
+            "remaining_count": row[4]
+        }
+        return cache, status
+
+    def _import_json_state(self):
+        cache_dir = os.path.join(self.log_path, "cache")
+        status_dir = os.path.join(self.log_path, "status")
+        backup_dir = os.path.join(self.log_path, "backup")
+
+        with self.transaction():
+            for status_file in glob.glob(os.path.join(status_dir, "*.json")):
+                instance_id = os.path.splitext(os.path.basename(status_file))[0]
+                cache = _read_json(os.path.join(cache_dir, f"{instance_id}.json"), default_cache())
+                status = _read_json(status_file, default_status())
+                self.save(instance_id, cache, status)
+
+            for status_file in glob.glob(os.path.join(backup_dir, "*_status.json")):
+                instance_id = os.path.basename(status_file)[:-len("_status.json")]
+                cache = _read_json(os.path.join(backup_dir, f"{instance_id}_cache.json"), default_cache())
+                status = _read_json(status_file, default_status())
+                with self.lock:
+                    self.conn.execute(
+                        f"INSERT OR REPLACE INTO instance_backup (instance_id, {', '.join(STATE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                        (instance_id,) + self._encode(cache, status)
+                    )
+
+
+def _read_json(path: str, default: dict):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(log_path: str) -> StateStore:
+    key = os.path.abspath(log_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = StateStore(log_path)
+        return _stores[key]
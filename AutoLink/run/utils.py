@@ -12,6 +12,29 @@ def determine_embedding_path(instance_id: str) -> str:
         embed_path = os.path.join(base_path, "localdb")
     return embed_path
 
+def determine_documents_path(instance_id: str) -> str:
+    base_path = "documents"
+    if instance_id.startswith("bq") or instance_id.startswith("ga"):
+        documents_path = os.path.join(base_path, "bigquery.json")
+    elif instance_id.startswith("sf"):
+        documents_path = os.path.join(base_path, "snowflake.json")
+    elif instance_id.startswith("local"):
+        documents_path = os.path.join(base_path, "localdb.json")
+    else:
+        raise ValueError(f"Unknown instance ID: {instance_id}")
+    return documents_path
+
+def read_external_knowledge(instance_id: str, knowledge_name: str) -> str:
+    if not knowledge_name:
+        return ""
+    knowledge_path = os.path.join("resource/documents", knowledge_name)
+    try:
+        with open(knowledge_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except Exception as e:
+        print(instance_id, e)
+        return ""
+
 def get_subdir(dir_path):
     subdirs = [
         name